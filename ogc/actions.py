@@ -5,6 +5,7 @@ from owslib.feature.schema import get_schema
 
 import geopandas as gpd
 import re
+from ogc.models import backfill
 
 
 def classify(modeladmin, request, queryset):
@@ -54,3 +55,13 @@ def create_legends(modeladmin, request, queryset):
     messages.success(request, f'{num_created} legends created')
     
 create_legends.short_description = 'Create default legends'
+
+def backfill_layers(modeladmin, request, queryset):
+    ''' fill missing legend urls and extents of selected layers '''
+    try:
+        count = backfill(queryset)
+        messages.success(request, f'Legend and extent of {count} layers updated')
+    except Exception as e:
+        messages.error(request, e)
+        
+backfill_layers.short_description = 'Fill missing legends and extents'
@@ -1,7 +1,7 @@
 from django.utils.text import gettext_lazy as _
 from django.contrib import admin
 from django.contrib.admin.decorators import register
-from ogc.models import Layer, Server, VERSIONS
+from ogc.models import Layer, Server, DownloadJob, VERSIONS
 from django.forms.models import ModelForm
 from django.core.exceptions import ValidationError
 from django.contrib import messages
@@ -9,7 +9,7 @@ from django.forms.widgets import TextInput, Select
 from ogc.models.legend import Range, Value, Legend
 from django.contrib.admin.filters import SimpleListFilter
 from owslib.feature.schema import get_schema
-from ogc.actions import classify, create_legends
+from ogc.actions import classify, create_legends, backfill_layers
 import json
 from geopandas.geodataframe import GeoDataFrame
 
@@ -18,7 +18,7 @@ class LayerAdmin(admin.ModelAdmin):
     list_display = ('server','title', 'layername')
     list_filter = ('server','server__service_type')
     search_fields = ('layername','title')
-    actions=[create_legends]
+    actions=[create_legends, backfill_layers]
     
 class LayerInline(admin.TabularInline):
     model = Layer
@@ -42,22 +42,42 @@ class ServerForm(ModelForm):
 @register(Server)    
 class ServerAdmin(admin.ModelAdmin):
     model = Server
-    actions = ['updateLayers']
+    actions = ['updateLayers', 'refresh_capabilities']
 #     inlines = [LayerInline]
     form = ServerForm
     list_display = ('name','service_type',)
     list_filter = ('service_type',)
     
     def updateLayers(self, request, queryset):
-        numCreated = 0
+        numCreated = numChanged = numRemoved = 0
         for server in queryset:
             try:
-                numCreated += server.update_layers()
+                created, changed, removed = server.update_layers()
+                numCreated += created
+                numChanged += changed
+                numRemoved += removed
             except Exception as e:
                 messages.error(request, e)
-        messages.success(request, _('{} new layers discovered.').format(numCreated))
+        messages.success(request, _('{} new layers discovered, {} layers changed, {} layers removed.').format(numCreated, numChanged, numRemoved))
     updateLayers.short_description=_('update layer list of selected servers')
 
+    def refresh_capabilities(self, request, queryset):
+        count = 0
+        for server in queryset:
+            try:
+                server.refresh_capabilities()
+                count += 1
+            except Exception as e:
+                messages.error(request, e)
+        messages.success(request, _('Capabilities of {} servers refreshed.').format(count))
+    refresh_capabilities.short_description=_('refresh capabilities of selected servers')
+
+    def save_model(self, request, obj, form, change):
+        admin.ModelAdmin.save_model(self, request, obj, form, change)
+        if change and {'url','service_type','version'} & set(form.changed_data):
+            # cached capabilities are no longer valid
+            obj.invalidate_capabilities()
+
 
 class ColorInline(admin.TabularInline):
     ''' replaces widget for color field with html5 color picker '''
@@ -122,3 +142,9 @@ class LegendAdmin(admin.ModelAdmin):
     
     class Media:
         js = ('js/wfsproperties.js',)
+
+@register(DownloadJob)
+class DownloadJobAdmin(admin.ModelAdmin):
+    list_display = ('layer', 'status', 'progress', 'created', 'started', 'finished')
+    list_filter = ('status',)
+    search_fields = ('layer__layername', 'layer__title')
@@ -0,0 +1,33 @@
+'''
+Content versions and conditional responses for views that return content that rarely changes.
+Versions are kept in the default cache and are shared between worker processes when the cache is. 
+'''
+import time
+
+from django.core.cache import cache
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+
+
+def content_version(name):
+    ''' returns current version of named content '''
+    # start with a new version when the key is missing (e.g. evicted), so that stale content is never considered current
+    return cache.get_or_set(f'version-{name}', lambda: int(time.time() * 1000), None)
+
+def bump_version(name):
+    ''' increments version of named content. When the version is missing, the next call to content_version() creates a new version '''
+    key = f'version-{name}'
+    value = cache.get(key)
+    # cache.incr of most backends stores the new value with the default timeout: versions must not expire
+    if value is not None:
+        cache.set(key, value + 1, None)
+
+def conditional(etag_func=None, last_modified_func=None):
+    '''
+    decorator for views that return content that rarely changes.
+    Sets ETag and/or Last-Modified, responds to conditional requests with 304 Not Modified 
+    without calling the view and compresses the response when the client accepts gzip encoding
+    '''
+    def decorator(view):
+        return gzip_page(condition(etag_func=etag_func, last_modified_func=last_modified_func)(view))
+    return decorator
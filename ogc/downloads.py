@@ -0,0 +1,170 @@
+'''
+Background processing of layer downloads
+
+@author: theo
+'''
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+from django.db import transaction, connections
+from django.utils import timezone
+
+from .models import DownloadJob
+from .models.download import download_path
+from .models.layer import parse_bbox
+
+logger = logging.getLogger(__name__)
+
+
+# options of Layer.download
+OPTIONS = ('dpi', 'srs', 'bbox', 'width', 'height', 'scale')
+
+# folder with cached download results in MEDIA_ROOT
+CACHE_DIR = 'downloads/cache'
+
+# maximum total size of cached download results in bytes
+CACHE_SIZE = getattr(settings, 'OGC_DOWNLOAD_CACHE_SIZE', 2048) * 1024 * 1024
+
+def normalize(options):
+    ''' returns download options with defaults and canonical values, so that equivalent requests have the same options '''
+    result = {'dpi': int(options.get('dpi') or 96)}
+    for key in ('scale', 'width', 'height'):
+        value = round(float(options.get(key) or 0))
+        if value:
+            result[key] = value
+    if 'scale' in result:
+        # scale overrides width and height
+        result.pop('width', None)
+        result.pop('height', None)
+    if options.get('srs'):
+        result['srs'] = options['srs'].upper()
+    bbox = parse_bbox(options.get('bbox'))
+    if bbox:
+        result['bbox'] = ','.join([str(value) for value in bbox[:4]] + ([bbox[4].upper()] if bbox[4] else []))
+    return result
+
+def cache_key(layer, options):
+    ''' returns key of a download in the result cache: hash of layer, normalized options and capabilities of the layer '''
+    version = hashlib.sha1((layer.capabilities or '').encode('utf-8')).hexdigest()
+    return hashlib.sha1(json.dumps([layer.pk, options, version], sort_keys=True).encode('utf-8')).hexdigest()
+
+def link_or_copy(source, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def cache_lookup(key):
+    ''' returns path of a cached download result or None when the result is not in the cache '''
+    folder = default_storage.path(f'{CACHE_DIR}/{key}')
+    try:
+        path = os.path.join(folder, next(iter(os.listdir(folder))))
+    except (OSError, StopIteration):
+        return None
+    # modification time is the time of last use for eviction
+    os.utime(path)
+    return path
+
+def cache_store(key, path):
+    ''' add a download result to the cache and evict least recently used results when the cache is too large '''
+    link_or_copy(path, default_storage.path(f'{CACHE_DIR}/{key}/{os.path.basename(path)}'))
+    cache_evict(CACHE_SIZE)
+
+def cache_evict(max_size):
+    ''' remove least recently used results until the total size of the cache is at most max_size bytes '''
+    root = default_storage.path(CACHE_DIR)
+    entries = []
+    for key in os.listdir(root):
+        try:
+            for name in os.listdir(os.path.join(root, key)):
+                stat = os.stat(os.path.join(root, key, name))
+                entries.append((stat.st_mtime, stat.st_size, key))
+        except OSError:
+            # removed by another worker
+            continue
+    total = sum(entry[1] for entry in entries)
+    for _mtime, size, key in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(os.path.join(root, key), ignore_errors=True)
+        total -= size
+
+def submit(layer, options):
+    '''
+    queue a download job for a layer with download options (dict), returns the job.
+    When the result is in the cache, the job is done immediately. 
+    When an identical job is waiting or running, that job is returned
+    '''
+    options = normalize({key: value for key, value in options.items() if key in OPTIONS})
+    key = cache_key(layer, options)
+    job = DownloadJob.objects.filter(key=key, status__in=(DownloadJob.PENDING, DownloadJob.RUNNING)).first()
+    if job is not None:
+        return job
+    job = DownloadJob.objects.create(layer=layer, options=json.dumps(options, sort_keys=True), key=key)
+    path = cache_lookup(key)
+    if path:
+        job.result.name = download_path(job, os.path.basename(path))
+        link_or_copy(path, job.result.path)
+        job.content_type = mimetypes.guess_type(path)[0]
+        job.status = DownloadJob.DONE
+        job.progress = 100
+        job.finished = timezone.now()
+        job.save(update_fields=('status', 'progress', 'result', 'content_type', 'finished'))
+    return job
+
+def claim_jobs(count):
+    ''' mark at most count pending jobs as running and return their ids '''
+    with transaction.atomic():
+        ids = list(DownloadJob.objects.select_for_update(skip_locked=True)
+                   .filter(status=DownloadJob.PENDING).order_by('created')
+                   .values_list('pk', flat=True)[:count])
+        DownloadJob.objects.filter(pk__in=ids).update(status=DownloadJob.RUNNING, started=timezone.now(), progress=0)
+    return ids
+
+def release_stale_jobs(age):
+    ''' requeue jobs that have been running for longer than age (timedelta), e.g. because a worker was killed '''
+    return DownloadJob.objects.filter(status=DownloadJob.RUNNING, started__lt=timezone.now()-age).update(status=DownloadJob.PENDING)
+
+def purge_jobs(age):
+    ''' delete finished jobs older than age (timedelta) and their results. Returns number of jobs deleted '''
+    jobs = DownloadJob.objects.filter(status__in=(DownloadJob.DONE, DownloadJob.FAILED), finished__lt=timezone.now()-age)
+    for job in jobs:
+        if job.result:
+            shutil.rmtree(default_storage.path(f'downloads/{job.pk}'), ignore_errors=True)
+    return jobs.delete()[0]
+
+def run_job(pk):
+    ''' download the layer of a job and save the result. Runs in a worker process '''
+    job = DownloadJob.objects.select_related('layer__server').get(pk=pk)
+    try:
+        filename, content, job.content_type = job.layer.download(progress=job.set_progress, **job.get_options())
+        with content:
+            job.result.save(filename, File(content), save=False)
+        if job.key:
+            cache_store(job.key, job.result.path)
+        job.status = DownloadJob.DONE
+        job.progress = 100
+    except Exception as e:
+        logger.exception(f'Download of {job.layer} failed')
+        job.status = DownloadJob.FAILED
+        job.error = str(e)
+    job.finished = timezone.now()
+    job.save(update_fields=('status', 'progress', 'result', 'content_type', 'finished', 'error'))
+    return job.status
+
+def process_jobs(executor, count):
+    ''' process a batch of at most count pending jobs using executor. Returns number of jobs processed '''
+    ids = claim_jobs(count)
+    if ids:
+        # worker processes must not share the database connection of this process
+        connections.close_all()
+        list(executor.map(run_job, ids))
+    return len(ids)
@@ -0,0 +1,20 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from ogc.models import Layer, backfill
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+
+    help = 'Fill missing legend urls and extents of layers'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('-s','--server',action='append',help='name of server (default: all servers)')
+
+    def handle(self, *args, **options):
+        layers = Layer.objects.all()
+        if options['server']:
+            layers = layers.filter(server__name__in=options['server'])
+        count = backfill(layers)
+        self.stdout.write(f'Legend and extent of {count} layers updated')
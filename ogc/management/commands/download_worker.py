@@ -0,0 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from ogc.downloads import process_jobs, release_stale_jobs, purge_jobs
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+
+    help = 'Download layers queued by the website'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('-w','--workers',type=int,default=min(4, os.cpu_count()),help='number of worker processes')
+        parser.add_argument('-i','--interval',type=float,default=1,help='seconds between checks for new jobs')
+        parser.add_argument('-s','--stale',type=int,default=60,help='requeue jobs that are running for more than this number of minutes')
+        parser.add_argument('-k','--keep',type=int,default=24,help='hours to keep finished jobs and their results')
+        parser.add_argument('-o','--once',action='store_true',help='process pending jobs and exit')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'] or 1)
+        stale = timedelta(minutes=options['stale'])
+        keep = timedelta(hours=options['keep'])
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                release_stale_jobs(stale)
+                purge_jobs(keep)
+                count = process_jobs(executor, workers)
+                if count:
+                    logger.debug(f'{count} downloads processed')
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
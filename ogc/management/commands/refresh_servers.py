@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from ogc.models import Server
+
+logger = logging.getLogger(__name__)
+
+def refresh(server, force, timeout):
+    ''' update layers of a server, returns server, elapsed time, result and error '''
+    start = time.time()
+    result = error = None
+    try:
+        result = server.update_layers(force=force, timeout=timeout)
+    except Exception as e:
+        logger.exception(f'Refresh of server {server} failed')
+        error = e
+    finally:
+        # every thread has its own database connection
+        connection.close()
+    return server, time.time() - start, result, error
+
+class Command(BaseCommand):
+
+    help = 'Refresh capabilities and layer lists of OWS servers'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('-s','--server',action='append',help='name of server to refresh (default: all servers)')
+        parser.add_argument('-t','--type',choices=('WMS','WFS'),help='refresh only servers of this type')
+        parser.add_argument('-w','--workers',type=int,default=8,help='number of servers to refresh concurrently')
+        parser.add_argument('--timeout',type=int,default=30,help='timeout in seconds of requests to a server')
+        parser.add_argument('-f','--force',action='store_true',help='update layers even when capabilities did not change')
+
+    def handle(self, *args, **options):
+        servers = Server.objects.order_by('name')
+        if options['server']:
+            servers = servers.filter(name__in=options['server'])
+        if options['type']:
+            servers = servers.filter(service_type=options['type'])
+
+        start = time.time()
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(1,options['workers'])) as executor:
+            jobs = [executor.submit(refresh, server, options['force'], options['timeout']) for server in servers]
+            for job in jobs:
+                server, elapsed, result, error = job.result()
+                if error:
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f'{server}: failed after {elapsed:.1f}s: {error}'))
+                else:
+                    added, changed, removed = result
+                    self.stdout.write(f'{server}: {added} added, {changed} changed, {removed} removed in {elapsed:.1f}s')
+        self.stdout.write(f'Refreshed {len(jobs)-failed} of {len(jobs)} servers in {time.time()-start:.1f}s')
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ogc', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Capabilities',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document', models.TextField(verbose_name='document')),
+                ('checksum', models.CharField(max_length=40, verbose_name='checksum')),
+                ('updated', models.DateTimeField(verbose_name='updated')),
+                ('server', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='capabilities', to='ogc.Server', verbose_name='server')),
+            ],
+            options={
+                'verbose_name': 'Capabilities',
+                'verbose_name_plural': 'Capabilities',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ogc', '0002_capabilities'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='capabilities',
+            name='synced',
+            field=models.CharField(blank=True, max_length=40, null=True, verbose_name='synchronized'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+def reset_synced(apps, schema_editor):
+    ''' force next refresh of servers to store capabilities of all layers '''
+    Capabilities = apps.get_model('ogc', 'Capabilities')
+    Capabilities.objects.update(synced=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ogc', '0003_capabilities_synced'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='layer',
+            name='capabilities',
+            field=models.TextField(blank=True, null=True, verbose_name='capabilities'),
+        ),
+        migrations.RunPython(reset_synced, migrations.RunPython.noop),
+    ]
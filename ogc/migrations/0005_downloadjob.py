@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import ogc.models.download
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ogc', '0004_layer_capabilities'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('options', models.TextField(default='{}', verbose_name='options')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=10, verbose_name='status')),
+                ('progress', models.PositiveSmallIntegerField(default=0, verbose_name='progress')),
+                ('result', models.FileField(blank=True, max_length=255, null=True, upload_to=ogc.models.download.download_path, verbose_name='result')),
+                ('content_type', models.CharField(blank=True, max_length=100, null=True, verbose_name='content type')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='started')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='finished')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='error')),
+                ('layer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='download_jobs', to='ogc.Layer')),
+            ],
+            options={
+                'verbose_name': 'download job',
+                'verbose_name_plural': 'download jobs',
+            },
+        ),
+    ]
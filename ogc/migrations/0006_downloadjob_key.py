@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ogc', '0005_downloadjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadjob',
+            name='key',
+            field=models.CharField(blank=True, db_index=True, max_length=40, null=True, verbose_name='key'),
+        ),
+    ]
@@ -1,3 +1,4 @@
-from .server import Server, VERSIONS
-from .layer import Layer
+from .server import Server, Capabilities, VERSIONS
+from .layer import Layer, backfill
 from .legend import Legend
+from .download import DownloadJob
@@ -0,0 +1,64 @@
+import json
+import uuid
+
+from django.db import models
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from ogc.models.layer import Layer
+
+def download_path(instance, filename):
+    return f'downloads/{instance.pk}/{filename}'
+
+class DownloadJob(models.Model):
+    ''' Request to download a layer, processed by the download_worker command '''
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS = (
+        (PENDING, _('pending')),
+        (RUNNING, _('running')),
+        (DONE, _('done')),
+        (FAILED, _('failed')),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    layer = models.ForeignKey(Layer, on_delete=models.CASCADE, related_name='download_jobs')
+    # download options (json), see Layer.download
+    options = models.TextField(_('options'), default='{}')
+    # key of the result in the download cache, see ogc.downloads.cache_key
+    key = models.CharField(_('key'), max_length=40, blank=True, null=True, db_index=True)
+    status = models.CharField(_('status'), max_length=10, choices=STATUS, default=PENDING, db_index=True)
+    # percentage completed
+    progress = models.PositiveSmallIntegerField(_('progress'), default=0)
+    result = models.FileField(_('result'), upload_to=download_path, max_length=255, blank=True, null=True)
+    content_type = models.CharField(_('content type'), max_length=100, blank=True, null=True)
+    created = models.DateTimeField(_('created'), default=timezone.now)
+    started = models.DateTimeField(_('started'), null=True, blank=True)
+    finished = models.DateTimeField(_('finished'), null=True, blank=True)
+    error = models.TextField(_('error'), blank=True, null=True)
+
+    def __str__(self):
+        return '{} ({})'.format(self.layer, self.status)
+
+    def get_options(self):
+        return json.loads(self.options)
+
+    def set_progress(self, progress):
+        ''' store percentage completed, called by Layer.download '''
+        self.progress = min(max(int(progress), 0), 100)
+        DownloadJob.objects.filter(pk=self.pk).update(progress=self.progress)
+
+    def to_json(self):
+        return {
+            'id': str(self.pk),
+            'layer': self.layer_id,
+            'status': self.status,
+            'progress': self.progress,
+            'url': reverse('ogc-download-result', args=[self.pk]) if self.status == DownloadJob.DONE and self.result else None,
+            'error': self.error,
+        }
+
+    class Meta:
+        verbose_name = _('download job')
+        verbose_name_plural = _('download jobs')
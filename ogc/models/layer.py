@@ -1,16 +1,138 @@
+from itertools import groupby
+import logging
+
 from django.db import models
 from django.utils.translation import gettext_lazy as _
-from ogc.models.server import Server
+from ogc.models.server import Server, layer_capabilities
+from ogc.signals import layers_changed
 import os
-from tempfile import TemporaryDirectory
+import json
+from types import SimpleNamespace
+import shutil
+from tempfile import TemporaryDirectory, SpooledTemporaryFile
 import zipfile
+import warnings
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
 
+from django.conf import settings
 import fiona
-from fiona.collection import BytesCollection
 import rasterio as rio
-from rasterio.io import MemoryFile
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, bounds as window_bounds
 from io import BytesIO
-        
+
+logger = logging.getLogger(__name__)
+
+# maximum width and height of a GetMap request of a download
+TILE_SIZE = getattr(settings, 'OGC_TILE_SIZE', 2048)
+
+# maximum size of a download result that is kept in memory
+SPOOL_SIZE = 16 * 1024 * 1024
+
+# number of concurrent GetMap requests of a download
+DOWNLOAD_THREADS = getattr(settings, 'OGC_DOWNLOAD_THREADS', 4)
+
+def backfill(queryset):
+    '''
+    fill missing legend urls and extents of layers in bulk.
+    Capabilities are requested only for layers without a snapshot, once per server.
+    returns number of layers updated
+    '''
+    queryset = queryset.filter(models.Q(legend__isnull=True)|models.Q(bbox__isnull=True)|models.Q(bbox=''))
+    updated = []
+    for server, layers in groupby(queryset.select_related('server').order_by('server'), key=lambda layer: layer.server):
+        layers = list(layers)
+        service = {}
+        if any(layer.details() is None for layer in layers):
+            try:
+                service = server.service
+            except Exception as e:
+                logger.error(f'Capabilities of server {server} not available: {e}')
+        for layer in layers:
+            try:
+                if layer.details() is None:
+                    layer.capabilities = json.dumps(layer_capabilities(service[layer.layername]))
+                if layer.legend is None:
+                    try:
+                        layer.legend = layer._get_legend()
+                    except KeyError:
+                        # no default style (e.g. WFS layer)
+                        pass
+                if not layer.bbox:
+                    layer.bbox = ','.join(map(str,layer.get_extent()))
+                updated.append(layer)
+            except Exception as e:
+                logger.error(f'Backfill of layer {layer} failed: {e}')
+    Layer.objects.bulk_update(updated, ['capabilities', 'legend', 'bbox'])
+    if updated:
+        layers_changed.send(sender=Layer, layers=[layer.pk for layer in updated])
+    return len(updated)
+
+def parse_bbox(value):
+    ''' returns tuple (minx, miny, maxx, maxy, crs) from a bbox option. crs is None when the bbox has no crs '''
+    if not value:
+        return None
+    parts = [part.strip() for part in str(value).split(',')]
+    if len(parts) not in (4, 5):
+        raise ValueError(f'Invalid bbox: {value}')
+    minx, miny, maxx, maxy = map(float, parts[:4])
+    if minx >= maxx or miny >= maxy:
+        raise ValueError(f'Invalid bbox: {value}')
+    return (minx, miny, maxx, maxy, parts[4] if len(parts) == 5 else None)
+
+def reproject_bbox(bbox, crs, default_crs=None):
+    ''' returns coordinates (minx, miny, maxx, maxy) of a parsed bbox in crs. A bbox without crs is in default_crs or crs '''
+    source = bbox[-1] or default_crs or crs
+    if source.upper() == crs.upper():
+        return tuple(bbox[:4])
+    return tuple(transform_bounds(source, crs, *bbox[:4]))
+
+def tiles(width, height, size):
+    ''' generate windows of at most size x size pixels that cover a raster of width x height pixels '''
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            yield Window(col, row, min(size, width - col), min(size, height - row))
+
+def getmap_tiled(service, layername, srs, transform, width, height, dpi, dest, progress=None):
+    '''
+    request a large map from a WMS server as a grid of smaller GetMap requests that are fetched concurrently.
+    Every tile is written to the open rasterio dataset dest as soon as it arrives, 
+    so at most a few tiles are held in memory.
+    progress is an optional function that is called with the fraction of tiles completed
+    '''
+    def fetch(window):
+        image = service.getmap(layers = [layername], 
+                               bbox = window_bounds(window, transform),
+                               format = 'image/jpeg',
+                               srs = srs,
+                               size = (window.width, window.height),
+                               dpi = dpi
+                               )
+        return window, image.read()
+
+    windows = list(tiles(width, height, TILE_SIZE))
+    pending = iter(windows)
+    done = 0
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS) as executor:
+        # keep a limited number of requests in flight
+        running = {executor.submit(fetch, window) for window in islice(pending, 2 * DOWNLOAD_THREADS)}
+        while running:
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                window, data = future.result()
+                with warnings.catch_warnings():
+                    # tiles are plain jpeg images, their position is known from window
+                    warnings.simplefilter('ignore', NotGeoreferencedWarning)
+                    with rio.open(BytesIO(data)) as src:
+                        dest.write(src.read(indexes=[1, 2, 3]), window=window)
+                done += 1
+                if progress:
+                    progress(done / len(windows))
+                running.update(executor.submit(fetch, window) for window in islice(pending, 1))
+
 class Layer(models.Model):
     ''' Layer in an OWS server '''
     layername = models.CharField(_('layername'), max_length=100)
@@ -24,38 +146,51 @@ class Layer(models.Model):
     tiled.Boolean=True
     legend = models.URLField(_('legend_url'), null=True, blank=True)
 
+    # snapshot of the layer's capabilities (json), updated when the server is refreshed
+    capabilities = models.TextField(_('capabilities'), null=True, blank=True)
+
             
     class Meta:
         verbose_name = _('Layer')
 
 
-    def _update_legend(self, style='default'):
+    def _get_legend(self, style='default'):
         url = self.details().styles[style]['legend']
         if url:
             url += '&LAYERTITLE=FALSE' 
+        return url
+
+    def _update_legend(self, style='default'):
+        url = self._get_legend(style)
         self.legend = url
         self.save(update_fields=('legend',))
         return url
     
-    def _try_update_legend(self, style='default'):
+    def legend_url(self, style='default'):
+        ''' returns legend url. Does not save the layer: missing legends are stored by backfill '''
+        if self.legend is not None:
+            return self.legend
         try:
-            return self._update_legend(style)
+            return self._get_legend(style)
         except:
-            return self.legend
-        
-    def legend_url(self, style='default'):
-        return self._try_update_legend(style) if self.legend is None else self.legend
+            return None
     
     def __str__(self):
         return '{}:{}'.format(self.server, self.layername)
 
     def details(self):
-        for _key, value in self.server.layer_details(self.layername).items():
-            return value
+        ''' returns snapshot of the layer's capabilities or None when the layer has not been refreshed yet '''
+        return SimpleNamespace(**json.loads(self.capabilities)) if self.capabilities else None
+
+    def refresh_details(self):
+        ''' request the layer's capabilities from the server and update the snapshot '''
+        self.capabilities = json.dumps(layer_capabilities(self.server.service[self.layername]))
+        self.save(update_fields=('capabilities',))
+        return self.details()
     
     def get_extent(self):
         details = self.details()
-        return details.boundingBoxWGS84 if details else []
+        return (details.boundingBoxWGS84 or []) if details else []
     
     def set_extent(self):
         ext = self.get_extent()
@@ -64,34 +199,42 @@ class Layer(models.Model):
         return ext
     
     def extent(self):
+        ''' returns extent in WGS84. Does not save the layer: missing extents are stored by backfill '''
         if not self.bbox:
-            return self.set_extent()
+            return self.get_extent()
         else:
             return list(map(float,self.bbox.split(',')))
 
-    def download(self, **options):
+    def download(self, progress=None, **options):
         '''
-        download layer from server
+        download layer from server. 
+        progress is an optional function that is called with the percentage completed
+        returns filename, open (temporary) file and content type of the result
         options:
         - dpi: output resolution, default=96 (QGIS servers only)
         - srs: srs of output
-        - bbox: bounding box in srs units
+        - bbox: bounding box as 'minx,miny,maxx,maxy' in srs units or as 'minx,miny,maxx,maxy,crs' in other units
         - width: output width in pixels
         - height: output width in pixels
         - scale desired output scale in srs units. Note that scale overrides width/height parameters 
         '''
+        def report(percent):
+            if progress:
+                progress(percent)
+
         service = self.server.service
     
         srs = options.get('srs')
+        window = parse_bbox(options.get('bbox'))
 
-        # TODO: implement bbox
         if self.server.service_type == 'WMS':
             
             dpi = int(options.get('dpi', 96))
 
             scale = int(options.get('scale', 0))
 
-            details = self.details()
+            # download queries the server anyway: refresh missing capabilities
+            details = self.details() or self.refresh_details()
             if srs:
                 try:
                     bbox = next(filter(lambda b: b[-1] == srs, details.crs_list))
@@ -101,6 +244,12 @@ class Layer(models.Model):
                 # default SRS
                 bbox = details.boundingBox
                 srs = bbox[-1]
+            if window:
+                # request the part of the layer inside the window
+                x0, y0, x1, y1 = reproject_bbox(window, srs)
+                bbox = [max(x0, bbox[0]), max(y0, bbox[1]), min(x1, bbox[2]), min(y1, bbox[3]), srs]
+                if bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+                    raise ValueError('bbox does not overlap layer')
 
             # size in map coordinates
             sizex, sizey = (bbox[2]-bbox[0], abs(bbox[3]-bbox[1]))
@@ -120,57 +269,77 @@ class Layer(models.Model):
                     height = int((width * sizey) / sizex)
             width = round(width)
             height = round(height)
-            image = service.getmap(layers = [self.layername], 
-                                bbox = bbox[:-1],
-                                format = 'image/jpeg',
-                                srs = srs,
-                                size = (width, height),
-#                                 transparent = True,
-                                dpi = dpi
-                                )
+            transform = rio.Affine(sizex/width, 0, bbox[0], 0, -sizey/height, bbox[3])
+            report(5)
             # QGIS server does not support geoTIFF output
-            # user rasterio to convert PNG output to geoTIFF
-            with rio.open(image) as src:
-                with MemoryFile() as tif:
-                    with tif.open(driver='GTiff', 
-                                  dtype='uint8', 
-                                  width=width, 
-                                  height=height, 
-                                  count=3,
-                                  crs=srs,
-                                  compress='LZW',
-                                  # for lossy compression use settings below
-                                  # compress='JPEG',
-                                  # photometric='YCBCR',
-                                  transform=rio.Affine(sizex/width, 0, bbox[0], 0, -sizey/height, bbox[3])
-                                  ) as dest:
-                        dest.write(src.read())
-                    return (f'{self.layername}.tif', tif.read(), 'image/tiff')
+            # use rasterio to mosaic the jpeg tiles into a geoTIFF
+            with TemporaryDirectory() as tempdir:
+                path = os.path.join(tempdir, f'{self.layername}.tif')
+                with rio.open(path, 'w',
+                              driver='GTiff', 
+                              dtype='uint8', 
+                              width=width, 
+                              height=height, 
+                              count=3,
+                              crs=srs,
+                              compress='LZW',
+                              # for lossy compression use settings below
+                              # compress='JPEG',
+                              # photometric='YCBCR',
+                              tiled=True,
+                              BIGTIFF='IF_SAFER',
+                              transform=transform
+                              ) as dest:
+                    getmap_tiled(service, self.layername, srs, transform, width, height, dpi, dest, 
+                                 lambda fraction: report(5 + 85 * fraction))
+                report(90)
+                # the open file remains readable after the temporary directory is removed
+                tif = open(path, 'rb')
+            return (f'{self.layername}.tif', tif, 'image/tiff')
         
         elif self.server.service_type == 'WFS':
             
             def zipdir(folder):
-                io = BytesIO()
-                with zipfile.ZipFile(io, mode="w",compression=zipfile.ZIP_DEFLATED) as zf:
+                # small archives stay in memory, large archives are written to disk
+                archive = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+                with zipfile.ZipFile(archive, mode="w",compression=zipfile.ZIP_DEFLATED) as zf:
                     for root, _dirs, files in os.walk(folder):
                         for fname in files:
                             zf.write(os.path.join(root, fname), fname)
-                return io.getvalue()
+                archive.seek(0)
+                return archive
             
-    
-            features = service.getfeature(typename=self.layername, outputFormat='GeoJSON')
+            bbox = None
+            if window:
+                # filter features on the server, in the native srs of the layer when known
+                details = self.details()
+                native = details.boundingBox[-1] if details and details.boundingBox else window[-1] or srs
+                if native is None:
+                    # srs unknown: use the bbox as given
+                    bbox = window[:4]
+                else:
+                    bbox = reproject_bbox(window, native, srs)
+                    if self.server.version != '1.0.0':
+                        bbox += (native,)
+            features = service.getfeature(typename=self.layername, bbox=bbox, outputFormat='GeoJSON')
+            report(50)
             # QGIS server does not support ESRI shapefile output
             # Use fiona to convert geojson to shp
-            with BytesCollection(features.read()) as source:
+            with TemporaryDirectory() as tempdir:
+                source_path = os.path.join(tempdir, 'features.json')
+                with open(source_path, 'wb') as f:
+                    shutil.copyfileobj(features, f)
                 # save features as shapefile in temp dir, return zipped dir as attachment in response
-                with TemporaryDirectory() as tempdir:
-                    with fiona.open(os.path.join(tempdir,f'{self.layername}.shp'), 
+                shapes = os.path.join(tempdir, 'shapes')
+                os.mkdir(shapes)
+                with fiona.open(source_path) as source:
+                    with fiona.open(os.path.join(shapes,f'{self.layername}.shp'), 
                                     mode = 'w', 
                                     driver='ESRI Shapefile',
                                     crs=source.crs,
                                     schema=source.schema) as sink:
                         for feature in source:
                             sink.write(feature)
-                            
-                    return (f'{self.layername}.zip', zipdir(tempdir), 'application/zip')
+                report(80)
+                return (f'{self.layername}.zip', zipdir(shapes), 'application/zip')
         
@@ -1,5 +1,13 @@
-from django.db import models
+from datetime import timedelta
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from owslib.etree import etree
+from ogc.signals import layers_changed
 from owslib.wms import WebMapService
 from owslib.wfs import WebFeatureService
 
@@ -23,6 +31,32 @@ VERSIONS = (
     )
 )
 
+def layer_capabilities(details):
+    ''' returns json serializable snapshot of the capabilities of a layer '''
+    def crs(value):
+        # WFS layers have owslib Crs objects instead of strings
+        if value is None or isinstance(value, str):
+            return value
+        return value.getcode() if hasattr(value, 'getcode') else str(value)
+    def bbox(box):
+        if not box:
+            return None
+        box = list(box)
+        if len(box) > 4:
+            box[4:] = map(crs, box[4:])
+        return box
+    styles = getattr(details, 'styles', None) or {}
+    return {
+        'title': details.title,
+        'boundingBox': bbox(getattr(details, 'boundingBox', None)),
+        'boundingBoxWGS84': bbox(getattr(details, 'boundingBoxWGS84', None)),
+        'crs_list': [bbox(box) if isinstance(box, (list, tuple)) else crs(box) for box in getattr(details, 'crs_list', None) or []],
+        'styles': {name: {'title': style.get('title'), 'legend': style.get('legend')} for name, style in styles.items()}
+    }
+
+# parsed services, cached per worker process: {server pk: (capabilities timestamp, service)}
+_services = {}
+
 class Server(models.Model):
     ''' OWS server '''
     name = models.CharField(_('name'), max_length=100, unique=True)
@@ -33,15 +67,54 @@ class Server(models.Model):
     def __str__(self):
         return self.name
 
-    @property
-    def service(self):
+    def _create_service(self, xml=None, timeout=30):
+        ''' create owslib service. Parses xml when provided, otherwise requests GetCapabilities '''
         if self.service_type == 'WMS':
-            return WebMapService(self.url, self.version)
+            return WebMapService(self.url, self.version, xml=xml, timeout=timeout)
         elif self.service_type == 'WFS':
-            return WebFeatureService(self.url, self.version)
+            return WebFeatureService(self.url, self.version, xml=xml, timeout=timeout)
         else:
             raise ValueError('Service not supported')
 
+    def refresh_capabilities(self, timeout=30):
+        ''' request capabilities from server and update the cache '''
+        service = self._create_service(timeout=timeout)
+        document = etree.tostring(service._capabilities).decode('utf-8')
+        caps, _created = Capabilities.objects.update_or_create(server=self, defaults={
+            'document': document,
+            'checksum': hashlib.sha1(document.encode('utf-8')).hexdigest(),
+            'updated': timezone.now()
+        })
+        _services[self.pk] = (caps.updated, service)
+        return service
+
+    def invalidate_capabilities(self):
+        ''' remove cached capabilities, next access to service will query the server '''
+        _services.pop(self.pk, None)
+        Capabilities.objects.filter(server=self).delete()
+
+    def get_service(self, refresh=False, timeout=30):
+        '''
+        returns owslib service.
+        Capabilities are stored in the database and the parsed service is kept in memory, 
+        the server is queried only when the cached capabilities are older than OGC_CAPABILITIES_TTL seconds 
+        '''
+        if not refresh:
+            ttl = timedelta(seconds=getattr(settings, 'OGC_CAPABILITIES_TTL', 3600))
+            caps = Capabilities.objects.filter(server=self, updated__gte=timezone.now()-ttl).defer('document').first()
+            if caps:
+                cached = _services.get(self.pk)
+                if cached and cached[0] == caps.updated:
+                    return cached[1]
+                service = self._create_service(xml=caps.document.encode('utf-8'), timeout=timeout)
+                _services[self.pk] = (caps.updated, service)
+                return service
+        return self.refresh_capabilities(timeout)
+
+    @property
+    def service(self):
+        return self.get_service()
+
     def layer_details(self, layername = None):
         if layername is None:
             # return details of all layers
@@ -55,25 +128,70 @@ class Server(models.Model):
         for layer in self.service.contents:
             yield layer
 
-    def update_layers(self, delete_nonexisting=True):
+    def update_layers(self, delete_nonexisting=True, force=False, timeout=30):
+        '''
+        synchronize layers with server contents.
+        Capabilities are requested once and layers are only updated when the capabilities have changed since the last update.
+        returns tuple with the number of layers added, changed and removed
+        '''
+        service = self.get_service(refresh=True, timeout=timeout)
+        caps = Capabilities.objects.get(server=self)
+        if caps.synced == caps.checksum and not force:
+            return (0, 0, 0)
 
-        if delete_nonexisting:
-            # delete layers that are not reported in service contents
-            newLayers = set(self.enum_layers())
-            self.layer_set.exclude(layername__in=newLayers).delete()
+        def attribution(details):
+            return details.attribution.get('title','') if hasattr(details,'attribution') else ''
 
-        # create new layers
-        numCreated = 0
-        for layername, details in self.layer_details().items():
-            _layer, created = self.layer_set.get_or_create(layername=layername,defaults = {
-                'title': details.title or layername,
-                'attribution': details.attribution.get('title','') if hasattr(details,'attribution') else ''
-            })
-            if created:
-                numCreated += 1
-        return numCreated
+        contents = {layername: service[layername] for layername in service.contents}
+        existing = {layer.layername: layer for layer in self.layer_set.all()}
+
+        created = []
+        changed = []
+        for layername, details in contents.items():
+            title = details.title or layername
+            capabilities = json.dumps(layer_capabilities(details))
+            layer = existing.get(layername)
+            if layer is None:
+                created.append(self.layer_set.model(server=self, layername=layername, title=title, 
+                                                    attribution=attribution(details), capabilities=capabilities))
+            elif layer.title != title or (layer.attribution or '') != attribution(details) or layer.capabilities != capabilities:
+                layer.title = title
+                layer.attribution = attribution(details)
+                layer.capabilities = capabilities
+                changed.append(layer)
+
+        # layers that are not reported in service contents
+        removed = [layer.pk for layername, layer in existing.items() if layername not in contents] if delete_nonexisting else []
+
+        with transaction.atomic():
+            if removed:
+                self.layer_set.filter(pk__in=removed).delete()
+            self.layer_set.model.objects.bulk_create(created)
+            self.layer_set.model.objects.bulk_update(changed, ['title', 'attribution', 'capabilities'])
+            caps.synced = caps.checksum
+            caps.save(update_fields=('synced',))
+        if changed:
+            layers_changed.send(sender=self.layer_set.model, layers=[layer.pk for layer in changed])
+
+        return (len(created), len(changed), len(removed))
 
         
     class Meta:
         verbose_name = _('Server')
-        
+
+
+class Capabilities(models.Model):
+    ''' Cached GetCapabilities document of an OWS server '''
+    server = models.OneToOneField(Server, models.CASCADE, related_name='capabilities', verbose_name=_('server'))
+    document = models.TextField(_('document'))
+    checksum = models.CharField(_('checksum'), max_length=40)
+    updated = models.DateTimeField(_('updated'))
+    # checksum of the document at the last update of the server's layers
+    synced = models.CharField(_('synchronized'), max_length=40, blank=True, null=True)
+
+    class Meta:
+        verbose_name = _('Capabilities')
+        verbose_name_plural = _('Capabilities')
+
+    def __str__(self):
+        return str(self.server)
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+
+from ogc.cache import bump_version
+
+# sent when layers are updated in bulk (without post_save signals), provides list of layer ids
+layers_changed = Signal(providing_args=['layers'])
+
+
+@receiver([post_save, post_delete], sender='ogc.Legend')
+@receiver([post_save, post_delete], sender='ogc.Range')
+@receiver([post_save, post_delete], sender='ogc.Value')
+def legend_changed(sender, **kwargs):
+    bump_version('legends')
@@ -14,7 +14,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path
-from .views import properties, layers, statistics, legends, download
+from .views import properties, layers, statistics, legends, download, download_status, download_result
 
 urlpatterns = [
     path('props/<int:pk>', properties, name='wfs-properties'),
@@ -22,4 +22,6 @@ urlpatterns = [
     path('legends/<int:pk>', legends, name='wfs-legends'),
     path('stats/<int:pk>', statistics, name='wfs-statistics'),
     path('download/<int:pk>', download, name='ogc-download'),
+    path('download/job/<uuid:job_id>', download_status, name='ogc-download-status'),
+    path('download/job/<uuid:job_id>/result', download_result, name='ogc-download-result'),
 ]
@@ -1,12 +1,37 @@
 import json
+import os
 
-from django.http.response import JsonResponse, HttpResponse
+from django.http.response import JsonResponse, HttpResponse, HttpResponseBadRequest, FileResponse, Http404
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from owslib.feature.schema import get_schema
 
 import geopandas as gpd
+from ogc.cache import conditional, content_version
 from ogc.models.layer import Layer
-from ogc.models.server import Server
+from ogc.models.server import Server, Capabilities
+from ogc.models.download import DownloadJob
+from ogc.downloads import submit
+
+
+def capabilities_updated(request, pk):
+    ''' returns time of last capabilities update of the server of a layer '''
+    return Capabilities.objects.filter(server__layer=pk).values_list('updated', flat=True).first()
+
+def capabilities_etag(request, pk):
+    updated = capabilities_updated(request, pk)
+    return f'layer-{pk}-{updated.timestamp()}' if updated else None
+
+def server_updated(request, pk):
+    ''' returns time of last capabilities update of a server '''
+    return Capabilities.objects.filter(server=pk).values_list('updated', flat=True).first()
+
+def server_etag(request, pk):
+    updated = server_updated(request, pk)
+    return f'server-{pk}-{updated.timestamp()}' if updated else None
+
+def legends_etag(request, pk):
+    return f'legends-{pk}-{content_version("legends")}'
 
 
 def properties1(request, pk):
@@ -21,7 +46,8 @@ def properties1(request, pk):
             'properties': schema.get('properties')
         }})
     
-    
+
+@conditional(etag_func=capabilities_etag, last_modified_func=capabilities_updated)
 def properties(request, pk):
     ''' return property list of a wfs layer using GetFeature '''
     layer = get_object_or_404(Layer, pk=pk)
@@ -37,6 +63,7 @@ def properties(request, pk):
         }})
 
 
+@conditional(etag_func=capabilities_etag, last_modified_func=capabilities_updated)
 def statistics(request, pk):
     ''' return statistics of layer's properties '''
     layer = get_object_or_404(Layer, pk=pk)
@@ -50,6 +77,7 @@ def statistics(request, pk):
     return HttpResponse(result,content_type='application/json')
 
 
+@conditional(etag_func=server_etag, last_modified_func=server_updated)
 def layers(request, pk):
     ''' return server's layer list with properties '''
     server = get_object_or_404(Server, pk=pk)
@@ -71,6 +99,7 @@ def layers(request, pk):
         }})
 
 
+@conditional(etag_func=legends_etag)
 def legends(request, pk):
     ''' return layer's legends '''
     def to_json(legend):
@@ -95,11 +124,11 @@ def legends(request, pk):
 
 def download(request, pk):
     '''
-    download layer from server
+    queue a download of a layer. Returns the job as json, see download_status
     query parameters (all optional):
     - dpi: output resolution, default=96 (QGIS servers only)
     - srs: srs of output
-    - bbox: bounding box in srs units
+    - bbox: bounding box as 'minx,miny,maxx,maxy' in srs units or as 'minx,miny,maxx,maxy,crs' in other units
     - width: output width in pixels
     - height: output width in pixels
     - scale desired output scale in srs units. Note that scale overrides width/height parameters 
@@ -108,11 +137,27 @@ def download(request, pk):
     options = request.GET.dict()
     if not 'dpi' in options:
         options.update(dpi=96)
-#     if not 'srs' in options:
-#         options.update(srs='EPSG:32637')
-#     if not 'scale' in options:
-#         options.update(scale=250000)
-    filename, content, content_type = layer.download(**options)
-    response = HttpResponse(content, content_type=content_type)
-    response['Content-Disposition'] = f'attachment; filename={filename}'
+    try:
+        job = submit(layer, options)
+    except ValueError as e:
+        return HttpResponseBadRequest(f'Invalid download options: {e}')
+    response = JsonResponse(job.to_json(), status=202)
+    response['Location'] = reverse('ogc-download-status', args=[job.pk])
     return response
+
+
+def download_status(request, job_id):
+    ''' returns status, progress and, when done, the url of the result of a download job '''
+    job = get_object_or_404(DownloadJob, pk=job_id)
+    return JsonResponse(job.to_json())
+
+
+def download_result(request, job_id):
+    ''' returns the result of a finished download job as attachment '''
+    job = get_object_or_404(DownloadJob, pk=job_id, status=DownloadJob.DONE)
+    try:
+        # FileResponse streams the file and sets Content-Length
+        return FileResponse(open(job.result.path, 'rb'), as_attachment=True, 
+                            filename=os.path.basename(job.result.name), content_type=job.content_type)
+    except (ValueError, FileNotFoundError):
+        raise Http404('Download result not found')
@@ -3,7 +3,6 @@ from django.contrib import messages
 from django.contrib.admin.decorators import register
 from django.db.models import Max
 from django.db.models.fields import TextField
-from django.db.utils import IntegrityError
 from django.forms.widgets import Textarea
 from django.shortcuts import render
 from django.utils.translation import gettext_lazy as _
@@ -13,7 +12,7 @@ from ogc.models import Layer as OGCLayer
 from .forms import LayerPropertiesForm, SelectMapForm
 from .models import Map, Layer, Group, DocumentGroup, Document
 from collections import OrderedDict
-from rapid.models import Photo
+from rapid.models import Photo, LayerState, PreviewJob
 
 
 admin.site.site_header = 'Kenya Rapid Administration'
@@ -183,18 +182,12 @@ class MapAdmin(admin.ModelAdmin):
     update_extent.short_description = _('Update extent of selected maps')
     
     def clone_map(self, request, queryset):
-        success = 0
-        errors = 0
-        for instance in queryset:
-            try:
-                instance.clone(request.user)
-                success += 1
-            except IntegrityError:
-                errors += 1
+        success = len(Map.clone_all(queryset, [request.user]))
+        errors = queryset.count() - success
         if success:
             messages.success(request, '{} maps were cloned successfully for user {}.'.format(success, request.user))
         if errors:
-            messages.error(request, '{} maps already exist for user {}.'.format(errors, request.user))
+            messages.error(request, '{} maps were skipped: a map with the same name already exists for user {}.'.format(errors, request.user))
     
     clone_map.short_description=_('Clone selected maps for current user')
                 
@@ -204,7 +197,7 @@ class DocumentInline(admin.TabularInline):
     
 @register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('name','cluster','group','doc','url')
+    list_display = ('name','cluster','group','filename','url')
     list_filter = ('group','cluster')
     search_fields = ('name',)
     actions = ('update_previews',)
@@ -217,10 +210,10 @@ class DocumentAdmin(admin.ModelAdmin):
     def update_previews(self, request, queryset):
         count = 0
         for doc in queryset:
-            doc.create_preview()
+            doc.request_preview(retry=True)
             count += 1
         if count:
-            messages.success(request, f'{count} previews were updated.')
+            messages.success(request, f'{count} previews were queued for update.')
         else:
             messages.warning(request, 'No previews were updated.')
     update_previews.short_description = 'Update previews of selected documents'
@@ -236,5 +229,20 @@ class DocumentGroupAdmin(admin.ModelAdmin):
 
 @register(Photo)
 class PhotoAdmin(admin.ModelAdmin):
-    ...
-    
\ No newline at end of file
+
+    def save_model(self, request, obj, form, change):
+        admin.ModelAdmin.save_model(self, request, obj, form, change)
+        if 'photo' in form.changed_data:
+            obj.create_derivatives()
+
+@register(LayerState)
+class LayerStateAdmin(admin.ModelAdmin):
+    list_display = ('layer', 'user', 'order', 'visible', 'opacity')
+    list_filter = ('user', 'layer__map')
+    
+
+@register(PreviewJob)
+class PreviewJobAdmin(admin.ModelAdmin):
+    list_display = ('document', 'status', 'created', 'started', 'finished')
+    list_filter = ('status',)
+    search_fields = ('document__name',)
@@ -10,3 +10,7 @@ class RapidConfig(AppConfig):
     name = 'rapid'
     label = 'rapid'
     verbose_name = 'rapid'
+
+    def ready(self):
+        # connect signal handlers
+        from . import signals
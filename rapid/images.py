@@ -0,0 +1,44 @@
+'''
+Resized copies (derivatives) of previews and photos for responsive images (srcset)
+
+@author: theo
+'''
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, features
+
+# name and maximum width and height of derivatives
+DERIVATIVES = (
+    ('thumb', 320),
+    ('medium', 800),
+    ('full', 1600),
+)
+
+def create_derivatives(path, prefix):
+    '''
+    create resized copies of an image file in MEDIA_ROOT/derivatives.
+    Images are saved as WebP or, when Pillow does not support WebP, as progressive JPEG.
+    returns dict with name, width and height of every derivative
+    '''
+    webp = features.check('webp')
+    result = {}
+    with Image.open(path) as image:
+        image = image.convert('RGBA' if webp and image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        for size, max_size in DERIVATIVES:
+            copy = image.copy()
+            copy.thumbnail((max_size, max_size))
+            name = f'derivatives/{prefix}-{size}.{"webp" if webp else "jpg"}'
+            target = os.path.join(settings.MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if webp:
+                copy.save(target, 'WEBP', quality=80)
+            else:
+                copy.save(target, 'JPEG', quality=80, optimize=True, progressive=True)
+            result[size] = {'name': name, 'width': copy.width, 'height': copy.height}
+    return result
+
+def srcset(derivatives):
+    ''' returns value for the srcset attribute of an img element from a dict of derivatives '''
+    return ', '.join(f'{default_storage.url(d["name"])} {d["width"]}w' for d in derivatives.values())
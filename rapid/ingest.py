@@ -0,0 +1,134 @@
+'''
+Bulk registration of documents from files on the server (see upload and upload2 commands)
+
+@author: theo
+'''
+import hashlib
+import logging
+import os
+import re
+import shutil
+import uuid
+from pathlib import Path
+
+from django.core.files.storage import default_storage
+
+from .models import Document, PreviewJob, blob_name
+from .search import add_documents
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+def document_name(path):
+    ''' returns name of the document for a file: the file name without extension and county prefix (e.g. 'ISL - ') '''
+    return re.sub(r'^[A-Z]{3}\s?[-_]\s?', '', Path(path).stem)
+
+def file_hash(path):
+    ''' returns sha1 hash of the contents of a file '''
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def store_blob(path, link=True):
+    '''
+    store the file at path in content addressed storage (see rapid.models.blob_name).
+    The file is hard-linked when link is True and the source is on the same file system as MEDIA_ROOT,
+    otherwise it is copied in chunks. Files that are already stored are not stored again.
+    returns the stored name and the sha1 hash of the contents
+    '''
+    temp = default_storage.path(f'blobs/tmp/{uuid.uuid4().hex}')
+    os.makedirs(os.path.dirname(temp), exist_ok=True)
+    try:
+        checksum = None
+        if link:
+            try:
+                os.link(path, temp)
+                checksum = file_hash(temp)
+            except OSError:
+                # different file system or hard links not supported
+                pass
+        if checksum is None:
+            sha1 = hashlib.sha1()
+            with open(path, 'rb') as src, open(temp, 'wb') as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    sha1.update(chunk)
+                    dst.write(chunk)
+            shutil.copystat(path, temp)
+            checksum = sha1.hexdigest()
+        name = blob_name(checksum, path)
+        target = default_storage.path(name)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(temp, target)
+        return name, checksum
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+def ingest_files(group, paths, cluster, executor, link=True, queue=False):
+    '''
+    register files as documents of group. Files are stored by content concurrently using executor
+    and documents are created with a single query. Files with the name of an existing document are skipped.
+    When queue is True preview jobs are queued for the new documents.
+    The new documents are added to the search index, their text is extracted by the index_documents command.
+    returns list of created documents
+    '''
+    existing = set(group.document_set.values_list('name', flat=True))
+    files = {}
+    for path in paths:
+        name = document_name(path)
+        if name in existing or name in files:
+            logger.debug(f'Skipped {path}')
+            continue
+        files[name] = path
+    if not files:
+        return []
+
+    def store(item):
+        name, path = item
+        doc = Document(group=group, cluster=cluster, name=name, description=name, url='', filename=os.path.basename(path))
+        doc.doc.name, doc.checksum = store_blob(path, link)
+        logger.debug(f'Stored {path} as {doc.doc.name}')
+        return doc
+
+    docs = Document.objects.bulk_create(executor.map(store, files.items()))
+    logger.debug(f'Created {len(docs)} documents in group {group}')
+    # primary keys of bulk created objects are not available on all databases
+    created = group.document_set.filter(name__in=files)
+    # make the new documents searchable by name and description until their text is indexed
+    add_documents(created)
+    if queue:
+        PreviewJob.objects.bulk_create([PreviewJob(document_id=pk) for pk in created.values_list('pk', flat=True)], ignore_conflicts=True)
+    return docs
+
+def ingest_folder(group, folder, cluster, executor, pattern=None, link=True, queue=False):
+    '''
+    register all files in folder and its subfolders as documents of group.
+    Subfolders are added as (title cased) child groups.
+    returns number of created documents
+    '''
+    folder = os.path.normpath(folder)
+    groups = {'': group}
+    count = 0
+    for root, dirs, files in os.walk(folder):
+        tail = root[len(folder)+1:]
+
+        # create subgroup if needed. os.walk visits the parent folder first
+        if tail not in groups:
+            parent, _, name = tail.rpartition('/')
+            groups[tail], created = groups[parent].children.get_or_create(name=name.title())
+            if created:
+                logger.debug(f'Created group {groups[tail]}')
+        target = groups[tail]
+
+        paths = []
+        for filename in files:
+            if pattern and not pattern.search(filename):
+                logger.debug(f'Skipped {filename}')
+                continue
+            paths.append(os.path.join(root, filename))
+        count += len(ingest_files(target, sorted(paths), cluster, executor, link, queue))
+    return count
@@ -1,48 +1,70 @@
 import logging
+import re
 
 from django.core.management.base import BaseCommand
 from rapid.models import Document, DocumentGroup
 from rapid.views import COUNTIES
+from rapid.tree import cache_trees
 
 logger = logging.getLogger(__name__)
 
-def tag(groups, cluster, force=False, recurse=True):
-    ''' tag all documents in a group '''
-    for group in groups:
-        logger.debug(f'Tagging group {group}')
-        query = group.document_set.all()
-        if not force:
-            # take only docs without cluster
-            query = query.filter(cluster=0)
-        query.update(cluster=cluster)
-        if recurse:
-            tag(group.children.all(), cluster, force, recurse)
+# maximum number of ids in a single UPDATE statement
+BATCH_SIZE = 1000
 
-def process_groups(groups, names, force=False, recurse=True):
+def matcher(names):
+    ''' returns function that returns the key of the only name found in a text, or None when no or several names are found '''
+    pattern = re.compile('|'.join(re.escape(v.lower()) for v in sorted(names.values(), key=len, reverse=True)))
+    keys = {v.lower(): k for k, v in names.items()}
+    def match(text):
+        tags = set(pattern.findall(text.lower()))
+        return keys[tags.pop()] if len(tags) == 1 else None
+    return match
+
+def tag_groups(groups, match, recurse=True):
+    ''' returns dict with cluster of groups tagged by name. Children of a tagged group get the cluster of their parent '''
+    children = {}
     for group in groups:
-        name = group.name.lower()
-        tags = [k for k,v in names.items() if v in name]
-        if len(tags) == 1:
-            tag([group], tags[0], force, recurse)
-        elif recurse:
-            process_groups(group.children.all(), names, force, recurse)
-
-def process_docs(names, force):
-    query = Document.objects.all()
-    if not force:
-        query = query.filter(cluster=0)
-    for doc in query:
-        name = doc.name.lower()
-        tags = [k for k,v in names.items() if v in name]
-        if len(tags) == 1:
-            logger.debug(f'Tagging document {doc.name}')
-            doc.cluster = tags[0]
-            doc.save(update_fields=('cluster',))
-    
+        children.setdefault(group['parent_id'], []).append(group)
+    tags = {}
+    def process(groups, cluster=None):
+        for group in groups:
+            tag = cluster or match(group['name'])
+            if tag is not None:
+                if cluster is None:
+                    logger.debug(f'Tagging group {group["name"]}')
+                tags[group['id']] = tag
+            if recurse:
+                process(children.get(group['id'], []), tag)
+    process(children.get(None, []))
+    return tags
+
+def tag_docs(docs, group_tags, match, force=False):
+    ''' returns dict with new cluster of documents, tagged by group or by document name '''
+    tags = {}
+    for doc in docs:
+        cluster = doc['cluster']
+        if force or cluster == '0':
+            cluster = group_tags.get(doc['group_id'], cluster)
+        if force or cluster == '0':
+            cluster = match(doc['name']) or cluster
+        if cluster != doc['cluster']:
+            logger.debug(f'Tagging document {doc["name"]}')
+            tags[doc['id']] = cluster
+    return tags
+
+def update_clusters(tags):
+    ''' update cluster of documents with one query per cluster (and batch of ids) '''
+    clusters = {}
+    for pk, cluster in tags.items():
+        clusters.setdefault(cluster, []).append(pk)
+    for cluster, ids in clusters.items():
+        for i in range(0, len(ids), BATCH_SIZE):
+            Document.objects.filter(pk__in=ids[i:i+BATCH_SIZE]).update(cluster=cluster)
+
 class Command(BaseCommand):
 
     help = 'Tag documents from group or doc name'
-    
+
     def add_arguments(self, parser):
         parser.add_argument('-f','--force',action='store_true',help='force')
         parser.add_argument('-r','--recurse',action='store_false',help='no recurse')
@@ -50,8 +72,16 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         force = options['force']
         recurse = options['recurse']
-        names = {k:v.lower() for k,v in COUNTIES.items()}
+        match = matcher(COUNTIES)
+
+        group_tags = tag_groups(DocumentGroup.objects.values('id', 'parent_id', 'name'), match, recurse=recurse)
+        docs = Document.objects.values('id', 'group_id', 'name', 'cluster')
+        if not force:
+            # take only docs without cluster
+            docs = docs.filter(cluster='0')
+        tags = tag_docs(docs, group_tags, match, force=force)
+        update_clusters(tags)
+        self.stdout.write(f'{len(tags)} documents tagged')
 
-        process_groups(DocumentGroup.objects.filter(parent__isnull=True), names, force=force, recurse=recurse)
-        process_docs(names, force=force)
-        
\ No newline at end of file
+        # documents have changed: rebuild cached document trees
+        cache_trees()
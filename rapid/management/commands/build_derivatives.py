@@ -0,0 +1,33 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from rapid.models import Document, Photo
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+
+    help = 'Create resized copies of photos and document previews'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('-f','--force',action='store_true',help='recreate existing resized copies')
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.all()
+        docs = Document.objects.exclude(preview='').exclude(preview__isnull=True).exclude(preview='na.png')
+        if not options['force']:
+            photos = photos.filter(derivatives__isnull=True)
+            docs = docs.filter(derivatives__isnull=True)
+        count = 0
+        for photo in photos:
+            try:
+                photo.create_derivatives()
+                count += 1
+            except Exception as e:
+                logger.error(f'Photo {photo} failed: {e}')
+        self.stdout.write(f'{count} photos processed')
+        count = 0
+        for doc in docs:
+            doc.create_derivatives()
+            count += 1
+        self.stdout.write(f'{count} previews processed')
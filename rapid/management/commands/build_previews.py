@@ -0,0 +1,40 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from rapid.models import Document
+from rapid.previews import build_preview
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+
+    help = 'Create previews of documents that have changed since their last preview'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('-w','--workers',type=int,default=os.cpu_count(),help='number of worker processes')
+        parser.add_argument('-c','--county',help='only documents of this county (cluster)')
+        parser.add_argument('-f','--force',action='store_true',help='recreate all previews')
+        parser.add_argument('--hash',action='store_true',help='detect changes by content hash instead of modification time and size')
+
+    def handle(self, *args, **options):
+        docs = Document.objects.exclude(doc='').exclude(doc__isnull=True)
+        if options['county']:
+            docs = docs.filter(cluster=options['county'])
+        ids = list(docs.values_list('pk', flat=True))
+
+        start = time.time()
+        # worker processes must not share the database connection of this process
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'] or 1)) as executor:
+            results = Counter(executor.map(partial(build_preview, force=options['force'], content_hash=options['hash']), ids, chunksize=4))
+        elapsed = time.time() - start
+
+        rate = len(ids) / elapsed if elapsed else 0
+        self.stdout.write(f'{len(ids)} documents processed in {elapsed:.1f}s ({rate:.1f} documents/s): '
+                          f'{results["created"]} created, {results["skipped"]} unchanged, {results["failed"]} failed')
@@ -0,0 +1,13 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from rapid.tree import cache_trees
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+
+    help = 'Build and cache the document trees of all counties'
+    
+    def handle(self, *args, **options):
+        cache_trees()
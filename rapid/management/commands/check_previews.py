@@ -0,0 +1,22 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from rapid.models import Document
+from rapid.previews import check_previews
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+
+    help = 'Check that preview files of documents exist and repair the preview state in the database'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('-q','--queue',action='store_true',help='queue new preview jobs for documents with missing previews')
+
+    def handle(self, *args, **options):
+        removed = check_previews(Document.objects.all())
+        for doc in removed:
+            logger.warning(f'Preview of document {doc.pk} ({doc}) is missing')
+            if options['queue']:
+                doc.request_preview(retry=True)
+        self.stdout.write(f'{len(removed)} missing previews removed')
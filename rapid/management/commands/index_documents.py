@@ -0,0 +1,38 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from rapid.models import Document
+from rapid.search import index_document
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+
+    help = 'Extract the text of documents that have changed since they were last indexed and update the search index'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('-w','--workers',type=int,default=os.cpu_count(),help='number of worker processes')
+        parser.add_argument('-c','--county',help='only documents of this county (cluster)')
+        parser.add_argument('-f','--force',action='store_true',help='extract the text of all documents')
+
+    def handle(self, *args, **options):
+        docs = Document.objects.all()
+        if options['county']:
+            docs = docs.filter(cluster=options['county'])
+        ids = list(docs.values_list('pk', flat=True))
+
+        start = time.time()
+        # worker processes must not share the database connection of this process
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'] or 1)) as executor:
+            results = Counter(executor.map(partial(index_document, force=options['force']), ids, chunksize=4))
+        elapsed = time.time() - start
+
+        self.stdout.write(f'{len(ids)} documents processed in {elapsed:.1f}s: '
+                          f'{results["indexed"]} indexed, {results["skipped"]} unchanged, {results["failed"]} failed')
@@ -0,0 +1,34 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from rapid.previews import process_jobs, release_stale_jobs
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+
+    help = 'Create previews of documents queued by the website'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('-w','--workers',type=int,default=os.cpu_count(),help='number of worker processes')
+        parser.add_argument('-i','--interval',type=float,default=2,help='seconds between checks for new jobs')
+        parser.add_argument('-s','--stale',type=int,default=60,help='requeue jobs that are running for more than this number of minutes')
+        parser.add_argument('-o','--once',action='store_true',help='process pending jobs and exit')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'] or 1)
+        stale = timedelta(minutes=options['stale'])
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                release_stale_jobs(stale)
+                count = process_jobs(executor, workers)
+                if count:
+                    logger.debug(f'{count} previews processed')
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+import logging
+import os
+
+from django.core.management.base import BaseCommand
+from rapid.models import Document
+from rapid.ingest import store_blob
+from rapid.tree import cache_trees
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+
+    help = 'Move document files to content addressed storage, identical files are stored only once'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('-k','--keep',action='store_true',help='keep the original files')
+
+    def handle(self, *args, **options):
+        docs = Document.objects.exclude(doc='').exclude(doc__isnull=True).exclude(doc__startswith='blobs/')
+        old = set()
+        count = 0
+        for doc in docs.iterator():
+            try:
+                path = doc.doc.path
+                doc.doc.name, doc.checksum = store_blob(path)
+            except OSError as e:
+                logger.error(f'Document {doc.pk} ({doc}) failed: {e}')
+                continue
+            doc.filename = doc.filename or os.path.basename(path)
+            Document.objects.filter(pk=doc.pk).update(doc=doc.doc.name, checksum=doc.checksum, filename=doc.filename)
+            old.add(path)
+            count += 1
+
+        blobs = Document.objects.filter(doc__startswith='blobs/').values('checksum').distinct().count()
+        self.stdout.write(f'{count} documents moved, {blobs} distinct files in storage')
+
+        if not options['keep']:
+            # remove original files that are not used anymore
+            for path in old:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f'{path} could not be removed: {e}')
+
+        # download urls have changed
+        cache_trees()
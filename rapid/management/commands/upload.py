@@ -1,13 +1,12 @@
-import os
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import glob
 import logging
-import re
 
 from django.core.management.base import BaseCommand
 from rapid.models import DocumentGroup
-from django.core.files.base import ContentFile
 from rapid.views import COUNTIES
+from rapid.ingest import ingest_files
+from rapid.tree import cache_trees
 logger = logging.getLogger(__name__)
 
 #/home/theo/git/rapid/media/X/general GWmaps
@@ -25,6 +24,9 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('-c','--county',default='0',help='county')
         parser.add_argument('-g','--group',help='group')
+        parser.add_argument('-w','--workers',type=int,default=8,help='number of threads to copy files')
+        parser.add_argument('--copy',action='store_true',help='always copy files, do not create hard links')
+        parser.add_argument('-q','--queue',action='store_true',help='queue preview jobs for new documents')
         parser.add_argument('pattern',help='pattern')
         
     def handle(self, *args, **options):
@@ -46,20 +48,9 @@ class Command(BaseCommand):
                 group, created = group.children.get_or_create(name=county_name)
                 if created:
                     logger.debug(f'Added group {group}')
-        for filename in glob.glob(pattern):
-            logger.debug(filename)
-            name = Path(filename).stem
-            # remove 'ISL - '
-            pattern = r'^[A-Z]{3}\s?[-_]\s?'
-            name = re.sub(pattern, '', name)
-            with open(filename,'rb') as f:
-                content = f.read()
-                doc_file = ContentFile(content,os.path.basename(filename))
-            doc, created = group.document_set.get_or_create(name=name,defaults = {
-                'cluster': county_id,
-                'description': name,
-                'url': '',
-                'doc': doc_file
-                })
-            if created:
-                logger.debug(f'Created document {doc}')
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            docs = ingest_files(group, sorted(glob.glob(pattern)), county_id, executor, link=not options['copy'], queue=options['queue'])
+        self.stdout.write(f'{len(docs)} documents added')
+
+        # documents have changed: rebuild cached document trees
+        cache_trees()
@@ -1,12 +1,12 @@
-import os
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import re
 
 from django.core.management.base import BaseCommand
 from rapid.models import DocumentGroup
-from django.core.files.base import ContentFile
 from rapid.views import COUNTIES
+from rapid.ingest import ingest_folder
+from rapid.tree import cache_trees
 logger = logging.getLogger(__name__)
 
 def key(val, d):
@@ -24,46 +24,11 @@ class Command(BaseCommand):
         parser.add_argument('-g','--group',help='group')
         parser.add_argument('-r','--recursive',action='store_true',help='traverse folders recursively')
         parser.add_argument('-p','--pattern',default='',help='regex search pattern')
+        parser.add_argument('-w','--workers',type=int,default=8,help='number of threads to copy files')
+        parser.add_argument('--copy',action='store_true',help='always copy files, do not create hard links')
+        parser.add_argument('-q','--queue',action='store_true',help='queue preview jobs for new documents')
         parser.add_argument('folder',help='folder')
 
-    def add_files(self, group, folder, county, recursive, pattern):
-
-        for root, dirs, files in os.walk(folder):
-
-            tail = root[len(folder)+1:]
-
-            # create subgroups if needed
-            target = group
-            for name in tail.split('/'):
-                if name:
-                    name = name.title()
-                    target, created = target.children.get_or_create(name=name)
-                    if created:
-                        logger.debug(f'Created group {target}')
-            
-            for filename in files:
-                if pattern and not pattern.search(filename):
-                    logger.debug(f'Skipped {filename}')
-                    continue
-
-                path = Path(root)/filename
-                logger.debug(path)
-
-                # remove 'ISL - '
-                name = re.sub(r'^[A-Z]{3}\s?[-_]\s?', '', path.stem)
-                with open(path,'rb') as f:
-                    content = f.read()
-                    doc_file = ContentFile(content,path.name)
-                doc, created = target.document_set.get_or_create(name=name,defaults = {
-                    'cluster': county,
-                    'description': name,
-                    'url': '',
-                    'doc': doc_file
-                    })
-                if created:
-                    logger.debug(f'Created document {doc}')
-        
-
     def handle(self, *args, **options):
         county = options.get('county')
         group_id = options['group']
@@ -89,5 +54,10 @@ class Command(BaseCommand):
                 if created:
                     logger.debug(f'Added group {group}')
         
-        self.add_files(group, folder, county, recursive, pattern)
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            count = ingest_folder(group, folder, county, executor, pattern, link=not options['copy'], queue=options['queue'])
+        self.stdout.write(f'{count} documents added')
+
+        # documents have changed: rebuild cached document trees
+        cache_trees()
         
\ No newline at end of file
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid', '0003_photo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='map',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='version'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('rapid', '0004_map_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LayerState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.SmallIntegerField(blank=True, null=True, verbose_name='order')),
+                ('visible', models.NullBooleanField(verbose_name='visible')),
+                ('opacity', models.DecimalField(blank=True, decimal_places=1, max_digits=4, null=True, verbose_name='opacity')),
+                ('layer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='states', to='rapid.Layer')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'layer state',
+                'verbose_name_plural': 'layer states',
+                'unique_together': {('user', 'layer')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+
+def set_paths(apps, schema_editor):
+    ''' fill materialized paths of existing document groups '''
+    DocumentGroup = apps.get_model('rapid', 'DocumentGroup')
+    parents = dict(DocumentGroup.objects.values_list('pk', 'parent_id'))
+    def path(pk):
+        return (path(parents[pk]) if parents[pk] else '/') + f'{pk}/'
+    for pk in parents:
+        DocumentGroup.objects.filter(pk=pk).update(path=path(pk))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid', '0005_layerstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentgroup',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(set_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid', '0006_documentgroup_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreviewJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=10, verbose_name='status')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='started')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='finished')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='error')),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='preview_job', to='rapid.Document')),
+            ],
+            options={
+                'verbose_name': 'preview job',
+                'verbose_name_plural': 'preview jobs',
+            },
+        ),
+    ]
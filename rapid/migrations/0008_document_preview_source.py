@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid', '0007_previewjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='preview_source',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
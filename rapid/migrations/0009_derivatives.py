@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid', '0008_document_preview_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='derivatives',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='derivatives',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid', '0009_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='preview_created',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='preview_size',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid', '0011_document_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='filename',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+    ]
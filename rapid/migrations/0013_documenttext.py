@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid', '0012_document_filename'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentText',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(blank=True)),
+                ('source', models.CharField(blank=True, max_length=64, null=True)),
+                ('vector', django.contrib.postgres.search.SearchVectorField(editable=False, null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='search_text', to='rapid.Document')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='documenttext',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['vector'], name='rapid_docum_vector_e8f550_gin'),
+        ),
+    ]
@@ -4,14 +4,25 @@ Created on May 20, 2019
 @author: theo
 '''
 import os
+import hashlib
 import json
+from decimal import Decimal
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import Prefetch, Value
+from django.db.models.functions import Concat, Substr
 from django.urls.base import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from ogc.cache import content_version, bump_version
 from ogc.models import Layer as OCGLayer
+from .images import create_derivatives, srcset
 
 import logging
 from django.db.utils import IntegrityError
@@ -19,41 +30,79 @@ from django.conf import settings
 logger = logging.getLogger(__name__)
 
 
+def duplicate(instance, **kwargs):
+    ''' returns unsaved copy of a model instance, kwargs override field values '''
+    values = {field.attname: getattr(instance, field.attname) 
+              for field in instance._meta.concrete_fields if not field.primary_key}
+    values.update(kwargs)
+    return type(instance)(**values)
+
+
 class Map(models.Model):
     ''' Collection of map layers '''
     name = models.CharField(_('name'), max_length=100)
     bbox = models.CharField(_('extent'), max_length=100, null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    # incremented when the map or any of its groups or layers changes, see rapid.signals
+    version = models.PositiveIntegerField(_('version'), default=0, editable=False)
     
     def clone(self, user):
         ''' clone this map for a specific user '''
-        usermap = Map.objects.filter(name=self.name, user=user).first()
-        if usermap:
+        clones = Map.clone_all([self], [user])
+        if not clones:
             raise IntegrityError('Map already exists.')
-        
-        # query groups and evaluate queryset
-        groups = list(self.group_set.all())
-
-        # clone ourselves
-        usermap = self
-        usermap.pk = None
-        usermap.user = user
-        usermap.save()
-
-        # clone groups and layers
-        for group in groups:
-            # query layers and evaluate queryset
-            layers = list(group.layer_set.all())
-            group.pk = None
-            group.map = usermap
-            group.save()
-            for layer in layers:
-                layer.pk = None
-                layer.map = usermap
-                layer.group = group
-                layer.save()
-    
-        return usermap
+        return clones[0]
+
+    @staticmethod
+    def clone_all(maps, users):
+        '''
+        clone maps for users in a single transaction, using a few bulk inserts.
+        maps that already exist for a user (by name) are skipped, 
+        as are maps with the same name as a map earlier in maps.
+        returns list of cloned maps
+        '''
+        maps = list(maps)
+        users = list(users)
+        names = [m.name for m in maps]
+        existing = set(Map.objects.filter(name__in=names, user__in=users).values_list('name', 'user_id'))
+        pairs = []
+        for m in maps:
+            for user in users:
+                if (m.name, user.pk) not in existing:
+                    # a user can have only one map with this name
+                    existing.add((m.name, user.pk))
+                    pairs.append((m, user))
+        if not pairs:
+            return []
+
+        # query groups and layers of all maps
+        groups = {}
+        for group in Group.objects.filter(map__in=maps):
+            groups.setdefault(group.map_id, []).append(group)
+        group_names = {group.pk: group.name for map_groups in groups.values() for group in map_groups}
+        layers = {}
+        for layer in Layer.objects.filter(map__in=maps):
+            layers.setdefault(layer.map_id, []).append(layer)
+
+        with transaction.atomic():
+            Map.objects.bulk_create([duplicate(m, user_id=user.pk, version=0) for m, user in pairs])
+            # not all database backends return primary keys from bulk_create: query ids of the new maps
+            map_ids = dict(((name, user_id), pk) for name, user_id, pk in 
+                           Map.objects.filter(name__in=names, user__in=users).values_list('name', 'user_id', 'pk'))
+            clones = [(m, map_ids[(m.name, user.pk)]) for m, user in pairs]
+            clone_ids = [clone_id for _m, clone_id in clones]
+            
+            Group.objects.bulk_create([duplicate(group, map_id=clone_id) 
+                                       for m, clone_id in clones for group in groups.get(m.pk, [])])
+            # map (map id, group name) to id of new group
+            group_ids = dict(((map_id, name), pk) for map_id, name, pk in 
+                             Group.objects.filter(map__in=clone_ids).values_list('map_id', 'name', 'pk'))
+
+            Layer.objects.bulk_create([duplicate(layer, map_id=clone_id, 
+                                                 group_id=group_ids.get((clone_id, group_names.get(layer.group_id))))
+                                       for m, clone_id in clones for layer in layers.get(m.pk, [])], batch_size=1000)
+
+        return list(Map.objects.filter(pk__in=clone_ids))
 
     def to_json(self):
         ''' return json dict of groups with layers on the map. '''
@@ -71,16 +120,106 @@ class Map(models.Model):
                      'legend': layer.layer.legend_url(),
                      'options': layer.options()
                      } 
-                    for index, layer in enumerate(group.layer_set.order_by('order'))]
+                    for index, layer in enumerate(group.layer_set.all())]
 
+        groups = self.group_set.order_by('order').prefetch_related(
+            Prefetch('layer_set', queryset=Layer.objects.select_related('layer__server').order_by('order')))
         return json.dumps({
             'groups': [
                     {'name': group.name, 
                      'layers': layers(group),
                      'state': 'show' if group.open else 'hide',
-                    } for group in self.group_set.order_by('order')
+                    } for group in groups
                 ]
             })
+
+    def config(self, user=None):
+        '''
+        return json configuration of the map. 
+        The configuration of the map is cached, the changes of a user to a public map are applied on every call. 
+        '''
+        key = f'map-config-{self.pk}-{self.version}'
+        config = cache.get(key)
+        if config is None:
+            config = self.to_json()
+            cache.set(key, config, getattr(settings, 'MAP_CONFIG_TIMEOUT', 86400))
+        if self.user_id is None and user is not None and user.is_authenticated:
+            states = {state.layer_id: state for state in LayerState.objects.filter(user=user, layer__map=self)}
+            if states:
+                config = apply_states(config, states)
+        return config
+
+    def update_layers(self, user, changes):
+        '''
+        apply changes to the order, visibility and opacity of layers on this map.
+        changes is a dict with layer id as key and a dict with changed values as value.
+        Changes are saved as layer states of the user when this is a public map.
+        raises Layer.DoesNotExist when a layer is not on this map and ValueError when a value is invalid
+        '''
+        def opacity(value):
+            value = Decimal(str(value)).quantize(Decimal('0.1'))
+            if not 0 <= value <= 1:
+                raise ValueError(f'Invalid opacity: {value}')
+            return value
+        def order(value):
+            value = int(value)
+            # order is stored in a SmallIntegerField
+            if not -32768 <= value <= 32767:
+                raise ValueError(f'Invalid order: {value}')
+            return value
+        def visible(value):
+            # bool('false') is True: accept json booleans only
+            if not isinstance(value, bool):
+                raise ValueError(f'Invalid visibility: {value}')
+            return value
+        converters = {'order': order, 'visible': visible, 'opacity': opacity}
+
+        layers = {layer.pk: layer for layer in self.layer_set.filter(pk__in=changes.keys())}
+        missing = set(changes.keys()) - set(layers.keys())
+        if missing:
+            raise Layer.DoesNotExist('Layers with id={} not found in map {}'.format(','.join(map(str,missing)), self))
+
+        if self.user_id is None:
+            states = {state.layer_id: state for state in LayerState.objects.filter(user=user, layer__in=layers.keys())}
+            targets = {pk: states.get(pk) or LayerState(user=user, layer_id=pk) for pk in changes.keys()}
+        else:
+            targets = layers
+        # changed objects per field, so that only changed fields are written
+        changed = {name: [] for name in converters}
+        for pk, values in changes.items():
+            for name, value in values.items():
+                if name in converters:
+                    setattr(targets[pk], name, converters[name](value))
+                    changed[name].append(targets[pk])
+
+        with transaction.atomic():
+            if self.user_id is None:
+                new = [state for state in targets.values() if state.pk is None]
+                if new:
+                    # a concurrent request may have created some of these states
+                    LayerState.objects.bulk_create(new, ignore_conflicts=True)
+                    ids = dict(LayerState.objects.filter(user=user, layer__in=[state.layer_id for state in new]).values_list('layer_id', 'pk'))
+                    for state in new:
+                        state.pk = ids[state.layer_id]
+                model = LayerState
+            else:
+                model = Layer
+            for name, objects in changed.items():
+                if objects:
+                    model.objects.bulk_update(objects, [name])
+            if self.user_id is not None:
+                # bulk_update does not send post_save signals
+                Map.objects.filter(pk=self.pk).update(version=models.F('version')+1)
+        if self.user_id is None:
+            self.bump_overlay(user)
+        return len(targets)
+
+    def overlay_version(self, user):
+        ''' returns version of the changes of a user to this map '''
+        return content_version(f'overlay-{self.pk}-{user.pk}')
+
+    def bump_overlay(self, user):
+        bump_version(f'overlay-{self.pk}-{user.pk}')
     
     def get_extent(self):
         ''' compute and return map extent from layers '''
@@ -105,8 +244,14 @@ class Map(models.Model):
         return ext
 
     def extent(self):
-        ''' return current extent. Calculate if self.bbox is undefined '''
-        return list(map(float, self.bbox.split(','))) if self.bbox else self.set_extent()
+        ''' return current extent. Calculate if self.bbox is undefined, and store it once it is known '''
+        if self.bbox:
+            return list(map(float, self.bbox.split(',')))
+        ext = self.get_extent()
+        if ext:
+            self.bbox = ','.join(map(str, ext))
+            self.save(update_fields=('bbox',))
+        return ext
 
     def __str__(self):
         result = self.name
@@ -209,29 +354,76 @@ class Layer(models.Model):
         return '{}'.format(self.layer)
 
 
+class LayerState(models.Model):
+    '''
+    Changes of a user to a layer on a public map.
+    Fields that are None are taken from the map's layer.
+    '''
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    layer = models.ForeignKey(Layer, on_delete=models.CASCADE, related_name='states')
+    order = models.SmallIntegerField(_('order'), null=True, blank=True)
+    visible = models.NullBooleanField(_('visible'))
+    opacity = models.DecimalField(_('opacity'), max_digits=4, decimal_places=1, null=True, blank=True)
+
+    def __str__(self):
+        return '{} ({})'.format(self.layer, self.user)
+
+    class Meta:
+        verbose_name = _('layer state')
+        verbose_name_plural = _('layer states')
+        unique_together = ('user', 'layer')
+
+
+def apply_states(config, states):
+    ''' apply layer states (dict of LayerState by layer id) to a json map configuration '''
+    data = json.loads(config)
+    for group in data['groups']:
+        def sort_key(layer):
+            state = states.get(layer['id'])
+            return layer['index'] if state is None or state.order is None else state.order
+        for layer in group['layers']:
+            state = states.get(layer['id'])
+            if state is not None:
+                if state.visible is not None:
+                    layer['visible'] = state.visible
+                if state.opacity is not None:
+                    layer['options']['opacity'] = float(state.opacity)
+        group['layers'].sort(key=sort_key)
+        for index, layer in enumerate(group['layers']):
+            layer['index'] = index
+    return json.dumps(data)
+
+
 class DocumentGroup(models.Model):
     name = models.CharField(max_length=100)    
     parent = models.ForeignKey('DocumentGroup', on_delete=models.CASCADE, blank=True, null=True, related_name='children')
     open = models.BooleanField(default=False)
     order = models.PositiveSmallIntegerField(default=1)
+    # materialized path: ids of ancestors and self, e.g. /1/5/12/
+    path = models.CharField(max_length=255, blank=True, db_index=True, editable=False)
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        parent_path = DocumentGroup.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or '/'
+        path = f'{parent_path}{self.pk}/'
+        if path != self.path:
+            # update path of this group and all its descendants
+            old_path = self.path or path
+            DocumentGroup.objects.filter(pk=self.pk).update(path=path)
+            DocumentGroup.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(path), Substr('path', len(old_path)+1)))
+            self.path = path
+
     def docs(self,cluster=0):
         ''' returns complete list of documents of this group and its children '''
-        query = self.document_set.all()
+        query = Document.objects.filter(group__path__startswith=self.path)
         if cluster:
             query = query.filter(cluster=cluster)  
-        for doc in query:
-            yield doc
-        for child in self.children.all():
-            yield from child.docs(cluster)
+        return query
         
     def empty(self,cluster=0):
         ''' returns true if there are no documents in this group, or any of its children ''' 
-        try:
-            next(self.docs(cluster))
-            return False
-        except StopIteration:
-            return True
+        return not self.docs(cluster).exists()
     
     def __str__(self):
         if self.parent is not None:
@@ -243,6 +435,11 @@ class DocumentGroup(models.Model):
 
 def upload_to_cluster(instance, filename):
     return 'cluster{0}/{1}'.format(instance.cluster or 0, filename)
+
+def blob_name(checksum, filename):
+    ''' returns name of a document file in content addressed storage: blobs/<hash[:2]>/<hash>.<ext> '''
+    ext = os.path.splitext(filename)[1].lower()
+    return f'blobs/{checksum[:2]}/{checksum}{ext}'
     
 class Document(models.Model):
     ''' Downloadable document '''
@@ -256,13 +453,82 @@ class Document(models.Model):
     description = models.TextField(blank=True, null=True)
     url = models.URLField(blank=True,null=True)
     doc = models.FileField(upload_to=upload_to_cluster, blank=True, null=True)
+    # sha1 hash of the document file. Documents with the same hash share the file (see blob_name)
+    checksum = models.CharField(max_length=40, blank=True, null=True, editable=False, db_index=True)
+    # original name of the document file
+    filename = models.CharField(max_length=255, blank=True, null=True, editable=False)
     preview = models.ImageField(upload_to='preview', blank=True, null=True)
+    # fingerprint of the document file at the time the preview was created
+    preview_source = models.CharField(max_length=64, blank=True, null=True, editable=False)
+    preview_size = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    preview_created = models.DateTimeField(blank=True, null=True, editable=False)
+    # resized copies of the preview (json, see rapid.images)
+    derivatives = models.TextField(blank=True, null=True, editable=False)
     order = models.PositiveSmallIntegerField(default=1)
     
     def __str__(self):
         return self.name
 
-    def create_preview(self, height=1080):
+    def save(self, *args, **kwargs):
+        if self.doc and not self.doc._committed:
+            self.store_blob(self.doc.file)
+        super().save(*args, **kwargs)
+
+    def store_blob(self, content):
+        ''' store uploaded content under its hash. Identical files are stored only once '''
+        sha1 = hashlib.sha1()
+        for chunk in content.chunks():
+            sha1.update(chunk)
+        self.checksum = sha1.hexdigest()
+        self.filename = os.path.basename(content.name)
+        name = blob_name(self.checksum, self.filename)
+        if not default_storage.exists(name):
+            content.seek(0)
+            name = default_storage.save(name, content)
+        self.doc.name = name
+        self.doc._committed = True
+
+    def get_filename(self):
+        ''' returns original name of the document file '''
+        return self.filename or os.path.basename(self.doc.name)
+
+    def get_download_url(self):
+        return reverse('document', args=[self.pk])
+
+    def source_fingerprint(self, content_hash=False):
+        ''' returns fingerprint of the document file: modification time and size, or sha1 hash of the contents '''
+        if not self.doc:
+            return None
+        if content_hash:
+            sha1 = hashlib.sha1()
+            with self.doc.open('rb') as f:
+                for chunk in f.chunks():
+                    sha1.update(chunk)
+            return sha1.hexdigest()
+        stat = os.stat(self.doc.path)
+        return f'{int(stat.st_mtime)}-{stat.st_size}'
+
+    def share_preview(self, fingerprint):
+        ''' copy the preview of another document with the same file. Returns False when there is no such preview '''
+        if not self.checksum:
+            return False
+        other = Document.objects.filter(checksum=self.checksum, preview_source=fingerprint).exclude(pk=self.pk)\
+            .exclude(preview='').exclude(preview__isnull=True).first()
+        if other is None:
+            return False
+        for field in ('preview', 'preview_source', 'preview_size', 'preview_created', 'derivatives'):
+            setattr(self, field, getattr(other, field))
+        self.save()
+        return True
+
+    def create_preview(self, height=1080, fingerprint=None, share=True):
+        ''' create the preview of the document file, or reuse the preview of a document with the same file when share is True '''
+        if share:
+            try:
+                if self.share_preview(fingerprint or self.source_fingerprint()):
+                    return
+            except OSError:
+                pass
         try:
             path = self.preview_manager.get_jpeg_preview(self.doc.path, height=height)
             index = path.find('preview')
@@ -270,25 +536,117 @@ class Document(models.Model):
         except:
             name = 'na.png'
         self.preview.name = name
+        try:
+            self.preview_source = fingerprint or self.source_fingerprint()
+        except OSError:
+            self.preview_source = None
+        try:
+            self.preview_size = os.path.getsize(self.preview.path)
+        except OSError:
+            self.preview_size = None
+        self.preview_created = timezone.now()
+        self.create_derivatives(save=False)
         self.save()
 
+    def create_derivatives(self, save=True):
+        ''' create resized copies of the preview '''
+        self.derivatives = None
+        if self.preview and self.preview.name != 'na.png':
+            try:
+                self.derivatives = json.dumps(create_derivatives(self.preview.path, f'document-{self.pk}'))
+            except Exception as e:
+                logger.error(f'Derivatives of preview of {self} could not be created: {e}')
+        if save:
+            self.save(update_fields=('derivatives',))
+
+    def preview_srcset(self):
+        ''' returns srcset of the resized previews or None when there are no resized previews '''
+        return srcset(json.loads(self.derivatives)) if self.derivatives else None
+
     def has_preview(self):
-        return self.preview and os.path.exists(self.preview.path)
+        ''' returns True if the document has a preview. Does not access the file system, see check_previews command '''
+        return bool(self.preview)
             
+    def request_preview(self, retry=False):
+        ''' queue a job to create the preview of this document, returns the job. Failed jobs are only requeued when retry is True '''
+        job, created = PreviewJob.objects.get_or_create(document=self)
+        idle = (PreviewJob.DONE, PreviewJob.FAILED) if retry else (PreviewJob.DONE,)
+        if not created and job.status in idle:
+            job.status = PreviewJob.PENDING
+            job.created = timezone.now()
+            job.save(update_fields=('status', 'created'))
+        return job
+
     @property
     def preview_url(self):
+        ''' returns url of the preview. Returns None and queues a preview job when there is no preview yet (failed jobs are not requeued) '''
         if not self.has_preview():
-            self.create_preview()
-        return self.preview.url if self.preview else None
+            self.request_preview()
+            return None
+        return self.preview.url
     
     class Meta:
         ordering = ('name',)
 
 
+class DocumentText(models.Model):
+    ''' Text of a document for full-text search, see rapid.search '''
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name='search_text')
+    text = models.TextField(blank=True)
+    # fingerprint of the document file at the time the text was extracted
+    source = models.CharField(max_length=64, blank=True, null=True)
+    vector = SearchVectorField(null=True, editable=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.document)
+
+    class Meta:
+        indexes = [GinIndex(fields=['vector'])]
+
+
+class PreviewJob(models.Model):
+    ''' Request to create the preview of a document, processed by the preview_worker command '''
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS = (
+        (PENDING, _('pending')),
+        (RUNNING, _('running')),
+        (DONE, _('done')),
+        (FAILED, _('failed')),
+    )
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name='preview_job')
+    status = models.CharField(_('status'), max_length=10, choices=STATUS, default=PENDING, db_index=True)
+    created = models.DateTimeField(_('created'), default=timezone.now)
+    started = models.DateTimeField(_('started'), null=True, blank=True)
+    finished = models.DateTimeField(_('finished'), null=True, blank=True)
+    error = models.TextField(_('error'), blank=True, null=True)
+
+    def __str__(self):
+        return '{} ({})'.format(self.document, self.status)
+
+    class Meta:
+        verbose_name = _('preview job')
+        verbose_name_plural = _('preview jobs')
+
+
 class Photo(models.Model):
     photo=models.ImageField(upload_to='photos')
+    # resized copies of the photo (json, see rapid.images)
+    derivatives = models.TextField(blank=True, null=True, editable=False)
     
     def __str__(self):
         return self.photo.name
+
+    def create_derivatives(self):
+        ''' create resized copies of the photo '''
+        self.derivatives = json.dumps(create_derivatives(self.photo.path, f'photo-{self.pk}'))
+        self.save(update_fields=('derivatives',))
+
+    def srcset(self):
+        ''' returns srcset of the resized photos or None when there are no resized photos '''
+        return srcset(json.loads(self.derivatives)) if self.derivatives else None
     
         
@@ -0,0 +1,105 @@
+'''
+Background processing of preview jobs
+
+@author: theo
+'''
+import logging
+import os
+
+from datetime import datetime
+import json
+
+from django.conf import settings
+from django.db import transaction, connections
+from django.utils import timezone
+
+from ogc.cache import bump_version
+
+from .models import PreviewJob, Document
+
+logger = logging.getLogger(__name__)
+
+
+def claim_jobs(count):
+    ''' mark at most count pending jobs as running and return their ids '''
+    with transaction.atomic():
+        ids = list(PreviewJob.objects.select_for_update(skip_locked=True)
+                   .filter(status=PreviewJob.PENDING).order_by('created')
+                   .values_list('pk', flat=True)[:count])
+        PreviewJob.objects.filter(pk__in=ids).update(status=PreviewJob.RUNNING, started=timezone.now(), finished=None, error=None)
+    return ids
+
+def release_stale_jobs(age):
+    ''' requeue jobs that have been running for longer than age (timedelta), e.g. because a worker was killed '''
+    return PreviewJob.objects.filter(status=PreviewJob.RUNNING, started__lt=timezone.now()-age).update(status=PreviewJob.PENDING)
+
+def run_job(pk):
+    ''' create the preview of a job's document. Runs in a worker process '''
+    job = PreviewJob.objects.select_related('document').get(pk=pk)
+    try:
+        job.document.create_preview()
+        job.status = PreviewJob.DONE
+    except Exception as e:
+        logger.exception(f'Preview of {job.document} failed')
+        job.status = PreviewJob.FAILED
+        job.error = str(e)
+    job.finished = timezone.now()
+    job.save(update_fields=('status', 'finished', 'error'))
+    return job.status
+
+def process_jobs(executor, count):
+    ''' process a batch of at most count pending jobs using executor. Returns number of jobs processed '''
+    ids = claim_jobs(count)
+    if ids:
+        # worker processes must not share the database connection of this process
+        connections.close_all()
+        list(executor.map(run_job, ids))
+    return len(ids)
+
+def build_preview(pk, force=False, content_hash=False):
+    '''
+    create the preview of a document when the document file has changed since the last preview was created. 
+    Runs in a worker process. Returns 'created', 'skipped' or 'failed'
+    '''
+    doc = Document.objects.get(pk=pk)
+    try:
+        fingerprint = doc.source_fingerprint(content_hash)
+        if not force and doc.has_preview() and doc.preview_source == fingerprint and os.path.exists(doc.preview.path):
+            return 'skipped'
+        doc.create_preview(fingerprint=fingerprint, share=not force)
+        return 'created'
+    except Exception:
+        logger.exception(f'Preview of {doc} failed')
+        return 'failed'
+
+def check_previews(queryset):
+    '''
+    repair the preview state of documents in queryset. 
+    Previews with missing files are removed, size and creation time of existing previews are updated.
+    returns list of documents whose preview was removed
+    '''
+    removed = []
+    updated = []
+    for doc in queryset.exclude(preview='').exclude(preview__isnull=True):
+        try:
+            stat = os.stat(doc.preview.path)
+        except OSError:
+            doc.preview = None
+            doc.preview_size = doc.preview_created = doc.preview_source = doc.derivatives = None
+            removed.append(doc)
+            continue
+        changed = False
+        if doc.preview_size != stat.st_size or doc.preview_created is None:
+            doc.preview_size = stat.st_size
+            doc.preview_created = doc.preview_created or timezone.make_aware(datetime.fromtimestamp(stat.st_mtime))
+            changed = True
+        if doc.derivatives and not all(os.path.exists(os.path.join(settings.MEDIA_ROOT, d['name'])) for d in json.loads(doc.derivatives).values()):
+            doc.derivatives = None
+            changed = True
+        if changed:
+            updated.append(doc)
+    Document.objects.bulk_update(removed + updated, ['preview', 'preview_size', 'preview_created', 'preview_source', 'derivatives'], batch_size=500)
+    if removed or updated:
+        # documents were updated without signals
+        bump_version('documents')
+    return removed
@@ -0,0 +1,105 @@
+'''
+Full-text search of documents.
+Text is extracted from the document files by the index_documents command and indexed
+together with name and description in a PostgreSQL tsvector (DocumentText.vector)
+
+@author: theo
+'''
+import logging
+import os
+import re
+import subprocess
+import zipfile
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Q, F, Value, TextField, FloatField
+
+from .models import Document, DocumentText
+
+logger = logging.getLogger(__name__)
+
+# text search configuration of PostgreSQL
+SEARCH_CONFIG = getattr(settings, 'SEARCH_CONFIG', 'english')
+
+# maximum number of characters of a document to index (a tsvector is limited to 1 MB)
+MAX_TEXT = 500000
+
+# xml parts with text in office open xml files
+OOXML_PARTS = re.compile(r'^(word/document|word/header\d*|word/footer\d*|ppt/slides/slide\d+|xl/sharedStrings)\.xml$')
+
+def use_tsvector():
+    ''' returns True if the database supports full-text search with tsvectors '''
+    return connection.vendor == 'postgresql'
+
+def extract_text(path, timeout=120):
+    ''' returns the text of a pdf, office open xml or plain text file. Returns an empty string for other files '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.pdf':
+        # pdftotext is part of poppler-utils
+        result = subprocess.run(['pdftotext', '-q', '-enc', 'UTF-8', path, '-'], stdout=subprocess.PIPE, timeout=timeout)
+        return result.stdout.decode('utf-8', errors='ignore')
+    if ext in ('.docx', '.pptx', '.xlsx'):
+        with zipfile.ZipFile(path) as z:
+            parts = [z.read(name).decode('utf-8', errors='ignore') for name in z.namelist() if OOXML_PARTS.match(name)]
+        return re.sub(r'<[^>]+>', ' ', ' '.join(parts))
+    if ext in ('.txt', '.csv', '.md'):
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            return f.read(MAX_TEXT)
+    return ''
+
+def document_vector(doc):
+    ''' returns expression for the search vector of a document: name, description and text with decreasing weights '''
+    return (SearchVector(Value(doc.name, output_field=TextField()), weight='A', config=SEARCH_CONFIG) +
+            SearchVector(Value(doc.description or '', output_field=TextField()), weight='B', config=SEARCH_CONFIG) +
+            SearchVector('text', weight='C', config=SEARCH_CONFIG))
+
+def update_vector(doc):
+    '''
+    update the search vector of a document, e.g. after its name or description has changed.
+    The index entry is created when it does not exist yet, its text is extracted later by index_documents
+    '''
+    DocumentText.objects.get_or_create(document=doc)
+    if use_tsvector():
+        DocumentText.objects.filter(document=doc).update(vector=document_vector(doc))
+
+def add_documents(docs):
+    ''' create index entries of new documents, e.g. after bulk_create which does not send post_save signals '''
+    for doc in docs:
+        update_vector(doc)
+
+def index_document(pk, force=False):
+    '''
+    extract the text of a document when the document file has changed since the last extraction and update the index.
+    Runs in a worker process. Returns 'indexed', 'skipped' or 'failed'
+    '''
+    doc = Document.objects.get(pk=pk)
+    entry, created = DocumentText.objects.get_or_create(document=doc)
+    try:
+        fingerprint = doc.source_fingerprint()
+        if not (force or created or entry.source != fingerprint):
+            return 'skipped'
+        entry.text = extract_text(doc.doc.path)[:MAX_TEXT] if fingerprint else ''
+        entry.source = fingerprint
+        entry.save()
+        update_vector(doc)
+        return 'indexed'
+    except Exception:
+        logger.exception(f'Indexing {doc} failed')
+        return 'failed'
+
+def search(query, county=None):
+    ''' returns documents matching query ordered by relevance (rank) '''
+    docs = Document.objects.select_related('group')
+    if county:
+        docs = docs.filter(Q(cluster=county)|Q(cluster=0))
+    if use_tsvector():
+        query = SearchQuery(query, config=SEARCH_CONFIG)
+        return docs.filter(search_text__vector=query)\
+            .annotate(rank=SearchRank(F('search_text__vector'), query))\
+            .order_by('-rank', 'name')
+    # no full-text search available: match words in name, description and text
+    for word in query.split():
+        docs = docs.filter(Q(name__icontains=word)|Q(description__icontains=word)|Q(search_text__text__icontains=word))
+    return docs.annotate(rank=Value(0, output_field=FloatField())).order_by('name')
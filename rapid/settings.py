@@ -109,6 +109,17 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Cache shared by all worker processes and by the preview and download workers.
+# The default location is in the project folder, which all docker services share (/code)
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+    }
+}
+
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
@@ -160,3 +171,24 @@ LOGGING = {
         },
     }
 }
+
+# maximum age (in seconds) of cached GetCapabilities documents of OWS servers
+OGC_CAPABILITIES_TTL = int(os.getenv('OGC_CAPABILITIES_TTL', 3600))
+
+# lifetime (in seconds) of cached map configurations
+MAP_CONFIG_TIMEOUT = int(os.getenv('MAP_CONFIG_TIMEOUT', 86400))
+
+# lifetime (in seconds) of cached document trees
+TREE_TIMEOUT = int(os.getenv('TREE_TIMEOUT', 86400))
+
+# PostgreSQL text search configuration for the document search
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'english')
+
+# maximum width and height (in pixels) of a single GetMap request for layer downloads
+OGC_TILE_SIZE = int(os.getenv('OGC_TILE_SIZE', 2048))
+
+# number of concurrent GetMap requests for a layer download
+OGC_DOWNLOAD_THREADS = int(os.getenv('OGC_DOWNLOAD_THREADS', 4))
+
+# maximum total size (in MB) of cached layer downloads
+OGC_DOWNLOAD_CACHE_SIZE = int(os.getenv('OGC_DOWNLOAD_CACHE_SIZE', 2048))
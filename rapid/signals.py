@@ -0,0 +1,52 @@
+'''
+Keep map and document versions and the document search index up to date.
+The version of a map is part of the key of its cached configuration (see Map.config)
+
+@author: theo
+'''
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from ogc.cache import bump_version
+from ogc.models import Layer as OGCLayer, Server
+from ogc.signals import layers_changed
+
+from .models import Map, Group, Layer, Document, DocumentGroup
+from .search import update_vector
+
+
+def bump(maps):
+    ''' increment version of maps in queryset '''
+    maps.update(version=F('version')+1)
+
+@receiver(post_save, sender=Map)
+def map_saved(sender, instance, **kwargs):
+    bump(Map.objects.filter(pk=instance.pk))
+
+@receiver([post_save, post_delete], sender=Group)
+@receiver([post_save, post_delete], sender=Layer)
+def map_item_changed(sender, instance, **kwargs):
+    bump(Map.objects.filter(pk=instance.map_id))
+
+@receiver([post_save, post_delete], sender=OGCLayer)
+def ogc_layer_changed(sender, instance, **kwargs):
+    bump(Map.objects.filter(pk__in=Layer.objects.filter(layer=instance).values('map')))
+
+@receiver([post_save, post_delete], sender=Server)
+def server_changed(sender, instance, **kwargs):
+    bump(Map.objects.filter(pk__in=Layer.objects.filter(layer__server=instance).values('map')))
+
+@receiver(layers_changed)
+def ogc_layers_changed(sender, layers, **kwargs):
+    bump(Map.objects.filter(pk__in=Layer.objects.filter(layer__in=layers).values('map')))
+
+@receiver([post_save, post_delete], sender=Document)
+@receiver([post_save, post_delete], sender=DocumentGroup)
+def document_changed(sender, instance, **kwargs):
+    bump_version('documents')
+
+@receiver(post_save, sender=Document)
+def document_saved(sender, instance, **kwargs):
+    # new document or name or description may have changed
+    update_vector(instance)
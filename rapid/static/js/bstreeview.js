@@ -118,11 +118,19 @@
                         .addClass(_this.settings.downloadIcon)
                 		.attr("href", node.href)
                 		.attr("title", `download ${node.text}`)
+                    if (node.download) {
+                    	// original file name of the document
+                    	treeItemIcon.attr("download", node.download)
+                    }
                     treeItem.append(treeItemIcon);
                     if (node.img) {
                     	// there is a thumbnail image, save as attribute
                     	treeItem.attr("thumb", node.img)
                     }
+                    if (node.srcset) {
+                    	// resized thumbnails for responsive image
+                    	treeItem.attr("srcset", node.srcset)
+                    }
                     if (node.id) {
                     	// save primary key of document (for lazy loading of previews)
                     	treeItem.attr("pk", node.id)
@@ -47,6 +47,37 @@ const iconInvisible = 'far fa-square'
 const spinner = 'fas fa-spinner fa-spin'
 const warning = 'fas fa-exclamation'
 
+// layer changes that have not been sent to the backend yet
+var pendingChanges = {}
+var syncTimer = null
+const syncDelay = 1000 // milliseconds
+
+function syncChanges () {
+  // send all pending layer changes to the backend in a single request
+  syncTimer = null
+  if (Object.keys(pendingChanges).length > 0) {
+    const body = JSON.stringify(pendingChanges)
+    pendingChanges = {}
+    return $.post('sync/', body)
+  }
+}
+
+function queueChange (id, values) {
+  // collect changes of a layer, send them when no more changes arrive within syncDelay
+  pendingChanges[id] = Object.assign(pendingChanges[id] || {}, values)
+  if (syncTimer) {
+    clearTimeout(syncTimer)
+  }
+  syncTimer = setTimeout(syncChanges, syncDelay)
+}
+
+window.addEventListener('beforeunload', () => {
+  if (Object.keys(pendingChanges).length > 0) {
+    navigator.sendBeacon('sync/', JSON.stringify(pendingChanges))
+    pendingChanges = {}
+  }
+})
+
 function reorderOverlays (overlays) {
   // show layers in proper order on map
   overlays.forEach(overlay => {
@@ -82,7 +113,7 @@ function toggleLayer (event, id) {
     parent.find('.collapse').collapse('show')
   }
   // inform backend about visibility change
-  $.post(`toggle/${id}`)
+  queueChange(id, { visible: layer.visible })
 }
 
 async function createOverlay (layer) {
@@ -129,6 +160,48 @@ function opacityChanged(value, id) {
 	const overlay = overlayLayers[id]
 	overlay.layerDefn.options.opacity = value
 	overlay.setOpacity(value)
+	queueChange(overlay.layerDefn.id, { opacity: value })
+}
+
+/**
+ * Queues a download job for a layer, polls its status and starts the download when the job is done
+ * @param event click event of the download link
+ * @param layerId id of the ogc layer
+ * @param id index of the overlay (for the status icon)
+ */
+function downloadLayer(event, layerId, id) {
+	event.preventDefault()
+	const status = $(`#status_${id}`)
+	const done = (title) => {
+		status.removeClass(spinner)
+		if (title) {
+			status.addClass(warning)
+			status.attr('title', title)
+		}
+		else {
+			status.removeAttr('title')
+		}
+	}
+	const poll = (url) => fetch(url).then(response => response.json()).then(job => {
+		if (job.status === 'done') {
+			done()
+			window.location.href = job.url
+		}
+		else if (job.status === 'failed') {
+			done(`Download failed: ${job.error}`)
+		}
+		else {
+			status.attr('title', `Downloading (${job.progress}%)`)
+			setTimeout(() => poll(url), 2000)
+		}
+	}).catch(error => done(`Download failed: ${error}`))
+	status.removeClass(warning)
+	status.addClass(spinner)
+	status.attr('title', 'Downloading')
+	fetch(`/ows/download/${layerId}`)
+		.then(response => poll(response.headers.get('Location')))
+		.catch(error => done(`Download failed: ${error}`))
+	return false
 }
 
 function showInfo(title, url) {
@@ -157,7 +230,7 @@ async function addOverlays (map, list, layers) {
 		    	
 		  	if (layer.downloadable) {
 		        // add download link that shows itself on hover
-		    	item += `<a class="download-link" href="/ows/download/${layer.layer_id}">
+		    	item += `<a class="download-link" href="/ows/download/${layer.layer_id}" onclick="downloadLayer(event, ${layer.layer_id}, ${id})">
 		    		<i class="my-1 ml-1 fas fa-arrow-alt-circle-down float-right" title="download ${layer.name}"></i>
 		    		</a>`
 		    }
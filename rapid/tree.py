@@ -0,0 +1,98 @@
+'''
+Document tree for the browse page, in a format suitable for bstreeview
+
+@author: theo
+'''
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from ogc.cache import content_version, bump_version
+
+from .models import DocumentGroup, Document
+
+
+def build_tree(county=0):
+    '''
+    returns list of nodes with all document groups and documents for a county (0 = all counties).
+    Groups and documents are queried once and the tree is assembled in memory.
+    Child groups without documents for the county are left out
+    '''
+    groups = list(DocumentGroup.objects.order_by('order'))
+    children = {}
+    for group in groups:
+        children.setdefault(group.parent_id, []).append(group)
+
+    queryset = Document.objects.order_by('cluster','order','name')
+    if county:
+        queryset = queryset.filter(Q(cluster=county)|Q(cluster=0))
+    docs = {}
+    for doc in queryset:
+        docs.setdefault(doc.group_id, []).append(doc)
+
+    def matches(doc):
+        return not county or doc.cluster == str(county)
+
+    # number of documents for the county in each group and its children
+    counts = {}
+    def count(group):
+        if group.pk not in counts:
+            counts[group.pk] = sum(map(matches, docs.get(group.pk, []))) + sum(count(child) for child in children.get(group.pk, []))
+        return counts[group.pk]
+
+    def process_docs(group):
+        result = []
+        for doc in docs.get(group.pk, []):
+            item = {
+                'id': doc.id,
+                'text': doc.name
+                }
+            if doc.doc:
+                if doc.url:
+                    item['href'] = doc.url
+                else:
+                    # served by the media server, the browser saves the file with its original name
+                    item['href'] = doc.doc.url
+                    item['download'] = doc.get_filename()
+                if doc.has_preview():
+                    item['img'] = doc.preview.url
+                    if doc.derivatives:
+                        item['srcset'] = doc.preview_srcset()
+            result.append(item)
+        return result
+
+    def process_group(group):
+        return {
+            'id': group.id,
+            'text': group.name,
+            'state': 'open' if group.open else 'closed',
+            'nodes': [process_group(child) for child in children.get(group.pk, []) if count(child)] + process_docs(group),
+        }
+
+    return [process_group(group) for group in children.get(None, [])]
+
+
+def cached_tree(county=0):
+    '''
+    returns json document tree for a county. 
+    Trees of the counties in rapid.views.COUNTIES are cached until a document or document group changes
+    '''
+    from .views import COUNTIES
+    if str(county) not in COUNTIES:
+        return json.dumps({'results': build_tree(county)})
+    key = f'tree-{county}-{content_version("documents")}'
+    tree = cache.get(key)
+    if tree is None:
+        tree = json.dumps({'results': build_tree(county)})
+        cache.set(key, tree, getattr(settings, 'TREE_TIMEOUT', 86400))
+    return tree
+
+def cache_trees():
+    ''' rebuild and cache the document trees of all counties '''
+    from .views import COUNTIES
+    # documents may have been updated without signals (e.g. by queryset.update)
+    bump_version('documents')
+    for county in COUNTIES:
+        cached_tree(int(county))
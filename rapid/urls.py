@@ -19,7 +19,7 @@ from django.urls.conf import include
 from django.conf import settings
 from django.conf.urls.static import static
 from .views import MapDetailView, HomeView, BrowseView, OverlayView,\
-    map_proxy, toggle, reorder, get_map, docs2tree, get_preview
+    map_proxy, sync, get_map, docs2tree, get_preview, download_document, search_documents
 
 urlpatterns = [
     path('', HomeView.as_view()),
@@ -28,13 +28,14 @@ urlpatterns = [
     path('view', OverlayView.as_view(),name='view'),
     path('admin/', admin.site.urls),
     path('ows/', include('ogc.urls')),
-    path('map/<int:pk>/reorder/', reorder,name='map-reorder'),
-    path('map/<int:mapid>/toggle/<int:layid>', toggle,name='map-toggle'),
+    path('map/<int:pk>/sync/', sync,name='map-sync'),
     path('map/<int:pk>/config/', get_map, name='map-config'),
     path('map/<int:pk>/', MapDetailView.as_view(),name='map-detail'),
     path('map', map_proxy, name='cluster-view'),
     path('tree', docs2tree),
+    path('search', search_documents, name='search'),
     path('preview/<int:pk>/', get_preview, name='preview'),
+    path('document/<int:pk>/', download_document, name='document'),
 ]
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
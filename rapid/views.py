@@ -4,20 +4,26 @@ Created on May 15, 2019
 @author: theo
 '''
 import json
+from urllib.parse import quote
 
 from django.conf import settings
+from django.core.paginator import Paginator
 from django.db.models import Q
 from django.http.response import HttpResponse, HttpResponseNotFound,\
-    JsonResponse
+    JsonResponse, HttpResponseBadRequest, FileResponse, Http404
 from django.shortcuts import get_object_or_404, redirect
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import TemplateView
 from django.views.generic.detail import DetailView
 
-from .models import Map, DocumentGroup, Layer
+from ogc.cache import conditional, content_version
+
+from .models import Map, Layer
+from .tree import cached_tree
+from .search import search
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from rapid.models import Document, Photo
+from rapid.models import Document, Photo, PreviewJob
 import random
 from random import randint
 
@@ -42,40 +48,26 @@ class MapDetailView(DetailView):
 
 @csrf_exempt
 #@login_required
-def reorder(request, pk):
-    ''' reorder layers in map
-        request.body contains ids of layers as json array in proper order
+def sync(request, pk):
+    ''' save changes to the order, visibility and opacity of layers in a map
+        request.body contains a json object with layer ids as keys and changed values as values, 
+        e.g. {"12": {"order": 0, "visible": true, "opacity": 0.5}, "13": {"order": 1}}
+        Changes are saved in the user's layer states when the map is a public map
     '''
     if not request.user.is_authenticated:
-        return HttpResponse('Authentication required to persist order of layers.', status=401)
+        return HttpResponse('Authentication required to persist layer changes.', status=401)
  
-    usermap = get_object_or_404(Map, pk=pk, user=request.user) # add user to query to make user user owns the map
-    layer_ids = json.loads(request.body.decode('utf-8'))
-    for index, layid in enumerate(layer_ids):
-        try:
-            layer = usermap.layer_set.get(pk=layid) 
-        except Layer.DoesNotExist:
-            return HttpResponseNotFound('Layer with id={} not found in map {}'.format(layid, usermap))
-        if layer.order != index:
-            layer.order = index
-            layer.save(update_fields=('order',))
+    # user must own the map or the map must be public
+    usermap = get_object_or_404(Map, Q(user=request.user)|Q(user__isnull=True), pk=pk)
+    try:
+        changes = {int(layid): values for layid, values in json.loads(request.body.decode('utf-8')).items()}
+        usermap.update_layers(request.user, changes)
+    except Layer.DoesNotExist as e:
+        return HttpResponseNotFound(e)
+    except (ValueError, TypeError, AttributeError, ArithmeticError) as e:
+        return HttpResponseBadRequest(f'Invalid layer changes: {e}')
 
     return HttpResponse(status=200)
-
-@csrf_exempt
-# @login_required
-def toggle(request, mapid, layid):
-    '''
-        Toggle visibility of a layer
-    '''
-    
-    if not request.user.is_authenticated:
-        return HttpResponse('Authentication required to persist visibility of layers.', status=401)
-    
-    layer = get_object_or_404(Layer, pk=layid)
-    layer.visible = not layer.visible
-    layer.save(update_fields=('visible',))
-    return HttpResponse(status=200)
     
 class HomeView(TemplateView):
     template_name = 'home.html'
@@ -87,6 +79,7 @@ class HomeView(TemplateView):
         query = Photo.objects.all()
         record = query[randint(0, query.count()-1)]
         context['photo']=record.photo.url
+        context['photo_srcset']=record.srcset()
         return context
     
 # class BrowseView(LoginRequiredMixin, TemplateView):
@@ -114,71 +107,106 @@ def map_proxy(request):
     clustername = COUNTIES.get(county, county)
     
     map_query = Map.objects.filter(name__icontains=clustername)
-    if request.user is None or request.user.is_anonymous:
-        clustermap = map_query.filter(user__isnull=True).first()
-    else:
+    clustermap = None
+    if request.user is not None and request.user.is_authenticated:
+        # user's own copy of the map, if any
         clustermap = map_query.filter(user=request.user).first()
     if clustermap is None:
-        # try to clone a default map
-        defmap = Map.objects.filter(name__icontains=clustername,user__isnull=True).first()
-        if not defmap:
+        # public map, user's changes are stored as layer states
+        clustermap = map_query.filter(user__isnull=True).first()
+        if clustermap is None:
             return HttpResponseNotFound(f'Map {clustername} not found for user {request.user}')
-        clustermap = defmap.clone(request.user)
     return redirect('map-detail', pk=clustermap.pk)
 
 
+def map_etag(request, pk):
+    map_obj = Map.objects.filter(pk=pk).only('version','user_id').first()
+    if map_obj is None:
+        return None
+    etag = f'map-{pk}-{map_obj.version}'
+    if map_obj.user_id is None and request.user.is_authenticated:
+        etag += f'-{request.user.pk}-{map_obj.overlay_version(request.user)}'
+    return etag
+
 # @login_required
+@conditional(etag_func=map_etag)
 def get_map(request, pk):
     ''' return user's layer configuration for all groups in the map '''
     map_obj = get_object_or_404(Map, pk=pk)
-    return HttpResponse(map_obj.to_json(), content_type='application/json')
+    return HttpResponse(map_obj.config(request.user), content_type='application/json')
+
+
+def download_document(request, pk):
+    ''' return document file with its original file name. 
+    Fallback for clients that do not support the download attribute of links to the media url of a document '''
+    doc = get_object_or_404(Document, pk=pk)
+    if not doc.doc:
+        raise Http404('Document has no file')
+    try:
+        response = FileResponse(open(doc.doc.path, 'rb'))
+    except FileNotFoundError:
+        raise Http404('Document file not found')
+    filename = doc.get_filename()
+    try:
+        filename.encode('ascii')
+        response['Content-Disposition'] = 'inline; filename="{}"'.format(filename.replace('"', ''))
+    except UnicodeEncodeError:
+        response['Content-Disposition'] = "inline; filename*=utf-8''{}".format(quote(filename))
+    return response
 
 
 def get_preview(request, pk):
-    ''' return preview url for a document '''
+    ''' return preview url for a document. 
+    When the preview does not exist yet, a preview job is queued and its status is returned with status code 202.
+    When the preview job has failed, the failed status is returned with status code 200 '''
     doc = get_object_or_404(Document, pk=pk)
-    return JsonResponse({'url':doc.preview_url})
+    url = doc.preview_url
+    if url:
+        return JsonResponse({'url': url, 'srcset': doc.preview_srcset(), 'status': 'done'})
+    status = doc.preview_job.status
+    return JsonResponse({'url': None, 'status': status}, status=200 if status == PreviewJob.FAILED else 202)
+
+
+def search_documents(request):
+    ''' return json response with documents matching the query, ordered by relevance. 
+    parameters: q (query), county, page and size (number of documents per page) '''
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return HttpResponseBadRequest('Query (q) is missing')
+    county = request.GET.get('county')
+    try:
+        size = min(max(int(request.GET.get('size', 20)), 1), 100)
+    except ValueError:
+        size = 20
+    paginator = Paginator(search(query, county), size)
+    page = paginator.get_page(request.GET.get('page'))
+    return JsonResponse({
+        'query': query,
+        'count': paginator.count,
+        'page': page.number,
+        'pages': paginator.num_pages,
+        'results': [{
+            'id': doc.id,
+            'name': doc.name,
+            'description': doc.description,
+            'group': doc.group.name,
+            'cluster': doc.cluster,
+            'href': doc.url or (doc.doc.url if doc.doc else None),
+            'download': doc.get_filename() if doc.doc and not doc.url else None,
+            'rank': doc.rank,
+            } for doc in page]
+        })
+
 
-       
+def tree_etag(request):
+    return f'tree-{content_version("documents")}'
+
+@conditional(etag_func=tree_etag)
 def docs2tree(request):
     ''' return json response with all documents in a format suitable for bstreeview '''
-    
-    def process_group(county, group, result):
-        children = []
-        for child in group.children.order_by('order'):
-            if not child.empty(county):
-                process_group(county, child, children)
-        result.append({
-            'id': group.id,
-            'text': group.name,
-            'state': 'open' if group.open else 'closed',
-            'nodes': children + process_docs(county, group),
-        })
-
-    def process_docs(county, group):
-        result = []
-        queryset = group.document_set.order_by('cluster','order','name')
-        if county:
-            queryset = queryset.filter(Q(cluster=county)|Q(cluster=0))
-        for doc in queryset:
-            item = {
-                'id': doc.id,
-                'text': doc.name
-                }
-            if doc.doc:
-                item['href'] = doc.url or doc.doc.url
-                if doc.has_preview():
-                    item['img'] = doc.preview.url
-            result.append(item)
-        return result
-    
     county = request.GET.get('county',0)
     try:
         county = int(county)
     except ValueError:
         county = 0
-    result = []
-    for group in DocumentGroup.objects.filter(parent__isnull=True).order_by('order'):
-        process_group(county, group, result)
-    return JsonResponse({'results': result})
-    
\ No newline at end of file
+    return HttpResponse(cached_tree(county), content_type='application/json')